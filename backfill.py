@@ -0,0 +1,31 @@
+import argparse
+import asyncio
+from datetime import datetime
+
+from database import db
+from currency_api import currency_api
+from config import BACKFILL_CONCURRENCY
+
+async def run(start: str, end: str, concurrency: int):
+    """Fill the rates table for a date range"""
+    await db.init_db()
+    await currency_api.open()
+    try:
+        result = await currency_api.backfill(start, end, concurrency)
+        print(f"Backfill {start} - {end}: {result}")
+    finally:
+        await currency_api.close()
+        await db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="CBU valyuta kurslari tarixini bazaga yuklash")
+    parser.add_argument('start', help="Boshlanish sanasi (YYYY-MM-DD)")
+    parser.add_argument('end', nargs='?', default=datetime.now().strftime('%Y-%m-%d'),
+                        help="Tugash sanasi (YYYY-MM-DD), standart: bugun")
+    parser.add_argument('--concurrency', type=int, default=BACKFILL_CONCURRENCY,
+                        help="Parallel so'rovlar soni")
+    args = parser.parse_args()
+    asyncio.run(run(args.start, args.end, args.concurrency))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import asyncio
+import zlib
+from typing import Any, Dict, List, Optional
+from aiohttp import web
+from telegram.error import Forbidden, RetryAfter
+
+# (code, English, Uzbek, Russian, nominal, rate)
+CANNED_CURRENCIES = [
+    ('USD', 'US Dollar', 'AQSH dollari', 'Доллар США', 1, '12650.45'),
+    ('EUR', 'Euro', 'EVRO', 'Евро', 1, '13710.12'),
+    ('RUB', 'Russian Ruble', 'Rossiya rubli', 'Российский рубль', 1, '138.55'),
+    ('GBP', 'Pound Sterling', 'Angliya funt sterlingi', 'Фунт стерлингов', 1, '16020.30'),
+    ('JPY', 'Japan Yen', 'Yaponiya iyenasi', 'Японская иена', 1, '84.91'),
+    ('CNY', 'Yuan Renminbi', 'Xitoy yuani', 'Китайский юань', 1, '1745.20'),
+    ('KZT', 'Kazakhstan Tenge', "Qozog'iston tengesi", 'Казахстанский тенге', 1, '26.41'),
+    ('KRW', 'Korean Won', 'Koreya voni', 'Вона Республики Корея', 1, '9.12'),
+]
+
+def canned_payload(date: str) -> List[Dict[str, Any]]:
+    """CBU-shaped JSON for one date"""
+    day = '.'.join(reversed(date.split('-')))
+    return [
+        {
+            'id': index + 1,
+            'Code': str(840 + index),
+            'Ccy': code,
+            'CcyNm_EN': name_en,
+            'CcyNm_UZ': name_uz,
+            'CcyNm_RU': name_ru,
+            'Nominal': str(nominal),
+            'Rate': rate,
+            'Diff': '-1.25',
+            'Date': day,
+        }
+        for index, (code, name_en, name_uz, name_ru, nominal, rate) in enumerate(CANNED_CURRENCIES)
+    ]
+
+class FakeCBUServer:
+    """Local stand-in for the CBU archive endpoint serving canned rates"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.requests = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+        """Base URL in the format CBU_API_URL expects"""
+        return f"http://{self.host}:{self.port}/"
+
+    async def handle_rates(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response(canned_payload(request.match_info['date']))
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/{date}/', self.handle_rates)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # Port 0 picks a free port; read back the one actually bound
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+class FakeBot:
+    """telegram.Bot stand-in with simulated latency, flood control and blocked users"""
+
+    def __init__(self, latency: float = 0.02, blocked_ratio: float = 0.02,
+                 retry_every: int = 0, retry_after: float = 0.5):
+        self.latency = latency
+        self.blocked_ratio = blocked_ratio
+        self.retry_every = retry_every
+        self.retry_after = retry_after
+        self.calls = 0
+        self.sent = 0
+
+    def is_blocked(self, chat_id) -> bool:
+        """Deterministic per chat so repeated runs block the same users"""
+        if not self.blocked_ratio:
+            return False
+        bucket = zlib.crc32(str(chat_id).encode()) % 10000
+        return bucket < self.blocked_ratio * 10000
+
+    async def send_message(self, chat_id, text: str, parse_mode: Optional[str] = None, **kwargs):
+        self.calls += 1
+        call = self.calls
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.retry_every and call % self.retry_every == 0:
+            raise RetryAfter(self.retry_after)
+        if self.is_blocked(chat_id):
+            raise Forbidden('Forbidden: bot was blocked by the user')
+        self.sent += 1
+        return None
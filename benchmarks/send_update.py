@@ -0,0 +1,234 @@
+"""Benchmark CurrencyScheduler.send_currency_update against fake Telegram and CBU.
+
+Every user count runs in a fresh subprocess so peak RSS is measured per size:
+
+    python -m benchmarks.send_update --users 1000 10000 100000 --output bench.json
+"""
+import argparse
+import asyncio
+import functools
+import inspect
+import json
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+from benchmarks.fakes import FakeBot, FakeCBUServer
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+BENCH_CURRENCIES = ('USD', 'EUR', 'RUB')
+BENCH_CHANNELS = ('@bench_channel', '-1001234567890')
+
+def populate_users(path: str, count: int):
+    """Insert synthetic users straight through sqlite3, outside the measured run"""
+    conn = sqlite3.connect(path)
+    try:
+        conn.executemany(
+            'INSERT INTO users (user_id, fullname, phone, phone_key, track_code) VALUES (?, ?, ?, ?, ?)',
+            (
+                (
+                    1_000_000 + index,
+                    f'Bench User {index}',
+                    f'+99890{index:07d}',
+                    f'+99890{index:07d}',
+                    f'TRK{index:08d}' if index % 3 else None,
+                )
+                for index in range(count)
+            )
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def instrument_db(database) -> Dict[str, Dict[str, float]]:
+    """Wrap the instance's public coroutine methods to accumulate call counts and time"""
+    stats: Dict[str, Dict[str, float]] = {}
+
+    def timed(name, method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                entry = stats.setdefault(name, {'calls': 0, 'seconds': 0.0})
+                entry['calls'] += 1
+                entry['seconds'] += time.perf_counter() - started
+        return wrapper
+
+    for name, method in inspect.getmembers(database, inspect.iscoroutinefunction):
+        # open/close are connection lifecycle, not queries
+        if not name.startswith('_') and name not in ('open', 'close'):
+            setattr(database, name, timed(name, method))
+    return stats
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(peak / divisor, 1)
+
+async def run_one(args) -> Dict[str, Any]:
+    """Measure one send against a fresh database with args.users rows"""
+    cbu = FakeCBUServer(latency=args.cbu_latency)
+    await cbu.start()
+
+    workdir = tempfile.mkdtemp(prefix='bench_')
+    db_path = os.path.join(workdir, 'bench.db')
+    # Must be set before the bot modules read config
+    os.environ['DATABASE_PATH'] = db_path
+    os.environ['CBU_API_URL'] = cbu.url
+
+    from database import db
+    from currency_api import currency_api
+    from broadcast import Broadcaster, OutboxWorker
+    from scheduler import CurrencyScheduler
+
+    await db.init_db()
+    await db.update_settings(selected_currencies=BENCH_CURRENCIES, channels=BENCH_CHANNELS)
+    await db.close()
+
+    started = time.perf_counter()
+    populate_users(db_path, args.users)
+    setup_time = time.perf_counter() - started
+
+    bot = FakeBot(
+        latency=args.latency,
+        blocked_ratio=args.blocked_ratio,
+        retry_every=args.retry_every,
+        retry_after=args.retry_after
+    )
+    sched = CurrencyScheduler()
+    sched.bot = bot
+    sched.broadcaster = Broadcaster(bot, rate=args.rate, concurrency=args.concurrency)
+    sched.outbox = OutboxWorker(sched.broadcaster)
+
+    db_stats = instrument_db(db)
+    await currency_api.open()
+    try:
+        started = time.perf_counter()
+        report = await sched.send_currency_update()
+        wall_time = time.perf_counter() - started
+    finally:
+        await currency_api.close()
+        await db.close()
+        await cbu.stop()
+
+    if report is None:
+        raise RuntimeError('send_currency_update returned no report')
+
+    return {
+        'users': args.users,
+        'recipients': report.total,
+        'setup_time': round(setup_time, 3),
+        'wall_time': round(wall_time, 3),
+        'msgs_per_sec': round(report.sent / wall_time, 1) if wall_time else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+        'db_time': round(sum(entry['seconds'] for entry in db_stats.values()), 3),
+        'db_calls': {
+            name: {'calls': int(entry['calls']), 'seconds': round(entry['seconds'], 4)}
+            for name, entry in sorted(db_stats.items())
+        },
+        'cbu_requests': cbu.requests,
+        'bot_calls': bot.calls,
+        'report': report.as_dict(),
+    }
+
+def child_command(args, users: int) -> List[str]:
+    return [
+        sys.executable, '-m', 'benchmarks.send_update', '--child',
+        '--users', str(users),
+        '--latency', str(args.latency),
+        '--blocked-ratio', str(args.blocked_ratio),
+        '--retry-every', str(args.retry_every),
+        '--retry-after', str(args.retry_after),
+        '--rate', str(args.rate),
+        '--concurrency', str(args.concurrency),
+        '--cbu-latency', str(args.cbu_latency),
+    ]
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def run_all(args) -> Dict[str, Any]:
+    """Run every size in its own process and collect the JSON results"""
+    results = []
+    for users in args.users:
+        print(f"Benchmarking {users} users...", file=sys.stderr)
+        completed = subprocess.run(child_command(args, users), capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(completed.stderr, file=sys.stderr)
+            results.append({'users': users, 'error': completed.stderr.strip().splitlines()[-1:]})
+            continue
+        # Bot modules print progress; the result is the last stdout line
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    return {
+        'benchmark': 'send_currency_update',
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'params': {
+            'latency': args.latency,
+            'blocked_ratio': args.blocked_ratio,
+            'retry_every': args.retry_every,
+            'retry_after': args.retry_after,
+            'rate': args.rate,
+            'concurrency': args.concurrency,
+            'cbu_latency': args.cbu_latency,
+        },
+        'results': results,
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the daily currency broadcast')
+    parser.add_argument('--users', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='synthetic user table sizes')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='simulated seconds per send_message call')
+    parser.add_argument('--blocked-ratio', type=float, default=0.02,
+                        help='share of users that answer 403 Forbidden')
+    parser.add_argument('--retry-every', type=int, default=5000,
+                        help='raise RetryAfter on every Nth call (0 disables)')
+    parser.add_argument('--retry-after', type=float, default=0.5,
+                        help='seconds requested by the simulated RetryAfter')
+    parser.add_argument('--rate', type=float, default=1000,
+                        help='broadcaster messages/sec; lifted above Telegram\'s 30 to measure overhead')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--cbu-latency', type=float, default=0.05,
+                        help='simulated seconds per CBU request')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.child:
+        args.users = args.users[0]
+        print(json.dumps(asyncio.run(run_one(args))))
+        return
+
+    result = json.dumps(run_all(args), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(result + '\n')
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(result)
+
+if __name__ == '__main__':
+    main()
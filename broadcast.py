@@ -0,0 +1,374 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from telegram import Bot
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from database import db
+from metrics import (
+    TELEGRAM_SEND_SECONDS, BROADCAST_MESSAGES, BROADCAST_ERRORS, BROADCAST_RUNS, BROADCAST_THROUGHPUT
+)
+from config import (
+    BROADCAST_RATE, BROADCAST_CHAT_INTERVAL, BROADCAST_GROUP_RATE_PER_MINUTE,
+    BROADCAST_CONCURRENCY, BROADCAST_MAX_RETRIES, BROADCAST_BACKOFF_BASE,
+    BROADCAST_BATCH_SIZE, BROADCAST_RESUME_HOURS
+)
+
+ChatId = Union[int, str]
+ResultCallback = Callable[[ChatId, str, Optional[str]], None]
+# Renders the digest for a subscribed currency list, None if it cannot be built
+RenderCallback = Callable[[Sequence[str]], Awaitable[Optional[str]]]
+
+# Per-recipient delivery statuses
+STATUS_PENDING = 'pending'
+STATUS_SENT = 'sent'
+STATUS_BLOCKED = 'blocked'
+STATUS_FAILED = 'failed'
+
+class TokenBucket:
+    """Async token bucket that can be paused when Telegram asks us to back off"""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for the given number of seconds"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+@dataclass
+class BroadcastReport:
+    """Result of one broadcast run"""
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    retried: int = 0
+    duration: float = 0.0
+    errors: Dict[str, int] = field(default_factory=dict)
+    blocked_ids: List[ChatId] = field(default_factory=list)
+
+    @property
+    def throughput(self) -> float:
+        """Delivered messages per second"""
+        return self.sent / self.duration if self.duration > 0 else 0.0
+
+    def merge(self, other: 'BroadcastReport'):
+        """Add the counters of another (batch) report to this one"""
+        self.total += other.total
+        self.sent += other.sent
+        self.failed += other.failed
+        self.blocked += other.blocked
+        self.retried += other.retried
+        self.blocked_ids.extend(other.blocked_ids)
+        for name, count in other.errors.items():
+            self.errors[name] = self.errors.get(name, 0) + count
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            'total': self.total,
+            'sent': self.sent,
+            'failed': self.failed,
+            'blocked': self.blocked,
+            'retried': self.retried,
+            'duration': round(self.duration, 3),
+            'throughput': round(self.throughput, 2),
+            'errors': dict(self.errors),
+        }
+
+def is_group_chat(chat_id: ChatId) -> bool:
+    """Channels and groups have negative ids or @usernames"""
+    if isinstance(chat_id, int):
+        return chat_id < 0
+    return str(chat_id).startswith(('@', '-'))
+
+class Broadcaster:
+    """Send one message to many chats within Telegram's rate limits"""
+
+    def __init__(self, bot: Bot,
+                 rate: float = BROADCAST_RATE,
+                 concurrency: int = BROADCAST_CONCURRENCY,
+                 max_retries: int = BROADCAST_MAX_RETRIES,
+                 backoff_base: float = BROADCAST_BACKOFF_BASE):
+        self.bot = bot
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.bucket = TokenBucket(rate)
+        # Telegram's per-minute group limit applies to each group and channel separately
+        self._group_buckets: Dict[ChatId, TokenBucket] = {}
+        self._last_sent: Dict[ChatId, float] = {}
+
+    def _group_bucket(self, chat_id: ChatId) -> TokenBucket:
+        bucket = self._group_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._group_buckets[chat_id] = TokenBucket(BROADCAST_GROUP_RATE_PER_MINUTE / 60)
+        return bucket
+
+    async def _wait_for_chat(self, chat_id: ChatId):
+        """Keep at least BROADCAST_CHAT_INTERVAL between messages to one chat"""
+        last = self._last_sent.get(chat_id)
+        if last is not None:
+            delay = last + BROADCAST_CHAT_INTERVAL - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def send_one(self, chat_id: ChatId, text: str, report: BroadcastReport,
+                       parse_mode: Optional[str] = ParseMode.MARKDOWN) -> Tuple[str, Optional[str]]:
+        """Deliver to a single chat, retrying transient errors and flood waits.
+
+        Each kind of retry is capped at max_retries. Returns the delivery status (sent, blocked or failed) and the last error.
+        """
+        attempt = 0
+        flood_waits = 0
+        while True:
+            await self._wait_for_chat(chat_id)
+            if is_group_chat(chat_id):
+                await self._group_bucket(chat_id).acquire()
+            await self.bucket.acquire()
+
+            started = time.perf_counter()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+                self._last_sent[chat_id] = time.monotonic()
+                report.sent += 1
+                return STATUS_SENT, None
+            except RetryAfter as e:
+                # Flood control applies to the whole bot, so pause everyone
+                self.bucket.pause(e.retry_after)
+                self._count_error(report, e)
+                if flood_waits >= self.max_retries:
+                    report.failed += 1
+                    print(f"Failed to send to {chat_id}: still flood-limited after {flood_waits + 1} attempts")
+                    return STATUS_FAILED, str(e)
+                flood_waits += 1
+                report.retried += 1
+                continue
+            except Forbidden as e:
+                report.blocked += 1
+                report.blocked_ids.append(chat_id)
+                self._count_error(report, e)
+                return STATUS_BLOCKED, str(e)
+            except BadRequest as e:
+                report.failed += 1
+                self._count_error(report, e)
+                print(f"Failed to send to {chat_id}: {e}")
+                return STATUS_FAILED, str(e)
+            except (NetworkError, asyncio.TimeoutError) as e:
+                self._count_error(report, e)
+                if attempt >= self.max_retries:
+                    report.failed += 1
+                    print(f"Failed to send to {chat_id} after {attempt + 1} attempts: {e}")
+                    return STATUS_FAILED, str(e)
+                await asyncio.sleep(self.backoff_base * (2 ** attempt))
+                attempt += 1
+                report.retried += 1
+            except TelegramError as e:
+                report.failed += 1
+                self._count_error(report, e)
+                print(f"Failed to send to {chat_id}: {e}")
+                return STATUS_FAILED, str(e)
+            finally:
+                TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - started)
+
+    @staticmethod
+    def _count_error(report: BroadcastReport, error: Exception):
+        name = type(error).__name__
+        report.errors[name] = report.errors.get(name, 0) + 1
+        BROADCAST_ERRORS.inc(name)
+
+    async def broadcast(self, chat_ids: Iterable[ChatId], text: str,
+                        parse_mode: Optional[str] = ParseMode.MARKDOWN,
+                        on_result: Optional[ResultCallback] = None) -> BroadcastReport:
+        """Send text to every chat with bounded concurrency and return a report.
+
+        on_result, if given, is called once per chat with (chat_id, status, error).
+        """
+        return await self.broadcast_messages(
+            ((chat_id, text) for chat_id in chat_ids), parse_mode, on_result
+        )
+
+    async def broadcast_messages(self, messages: Iterable[Tuple[ChatId, str]],
+                                 parse_mode: Optional[str] = ParseMode.MARKDOWN,
+                                 on_result: Optional[ResultCallback] = None) -> BroadcastReport:
+        """Like broadcast, but each (chat_id, text) pair carries its own text"""
+        queue: asyncio.Queue = asyncio.Queue()
+        for message in messages:
+            queue.put_nowait(message)
+
+        report = BroadcastReport(total=queue.qsize())
+        started = time.monotonic()
+
+        async def worker():
+            while True:
+                try:
+                    chat_id, text = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    status, error = await self.send_one(chat_id, text, report, parse_mode)
+                except Exception as e:
+                    report.failed += 1
+                    self._count_error(report, e)
+                    print(f"Unexpected error sending to {chat_id}: {e}")
+                    status, error = STATUS_FAILED, str(e)
+                BROADCAST_MESSAGES.inc(status)
+                if on_result is not None:
+                    on_result(chat_id, status, error)
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, report.total))]
+        if workers:
+            await asyncio.gather(*workers)
+
+        report.duration = time.monotonic() - started
+        self._last_sent.clear()
+        return report
+
+class OutboxWorker:
+    """Drain broadcast runs from the outbox table so they survive restarts"""
+
+    def __init__(self, broadcaster: Broadcaster, batch_size: int = BROADCAST_BATCH_SIZE,
+                 render: Optional[RenderCallback] = None):
+        self.broadcaster = broadcaster
+        self.batch_size = batch_size
+        # Without a renderer every recipient gets the run's text
+        self.render = render
+        self._tasks = set()
+
+    async def enqueue(self, text: str, minute: Optional[int] = None, include_default: bool = True) -> int:
+        """Create a run for the users and channels of a delivery minute (all of them if None); returns its id"""
+        run_id = await db.create_broadcast_run(text, minute=minute, include_default=include_default)
+        print(f"Broadcast run {run_id} enqueued")
+        return run_id
+
+    async def render_variants(self, run_id: int, force: bool = False) -> Dict[str, str]:
+        """Render one digest per distinct subscription of a run.
+
+        Work grows with the number of distinct currency sets, not recipients. Already
+        rendered variants are kept unless force is set (the final text at release time).
+        """
+        variants = await db.get_broadcast_variants(run_id)
+        texts = {variant: text for variant, text in variants.items() if text}
+        if self.render is None:
+            return texts
+
+        rendered = {}
+        for variant, text in variants.items():
+            if text and not force:
+                continue
+            text = await self.render(variant.split(','))
+            if text:
+                rendered[variant] = text
+        await db.set_broadcast_variants(run_id, rendered)
+        texts.update(rendered)
+        if rendered:
+            print(f"Broadcast run {run_id}: rendered {len(rendered)} of {len(variants)} digest variants")
+        return texts
+
+    async def drain(self, run_id: int) -> Optional[BroadcastReport]:
+        """Send every pending delivery of a run in batches and mark the results"""
+        run = await db.get_broadcast_run(run_id)
+        if run is None:
+            print(f"Broadcast run {run_id} not found")
+            return None
+
+        # Subscribers whose digest could not be built get the default one
+        texts = await self.render_variants(run_id)
+        report = BroadcastReport()
+        started = time.monotonic()
+        last_id = 0
+
+        while True:
+            batch = await db.get_pending_deliveries(run_id, last_id, self.batch_size)
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            outbox_ids = {chat_id: outbox_id for outbox_id, chat_id, _ in batch}
+            results = []
+
+            def on_result(chat_id: ChatId, status: str, error: Optional[str]):
+                results.append((status, error, outbox_ids[chat_id]))
+
+            batch_report = await self.broadcaster.broadcast_messages(
+                [(chat_id, texts.get(variant) or run['text']) for _, chat_id, variant in batch],
+                on_result=on_result
+            )
+            await db.mark_deliveries(results)
+            report.merge(batch_report)
+
+        await db.finish_broadcast_run(run_id)
+        await self.purge()
+        report.duration = time.monotonic() - started
+        BROADCAST_RUNS.inc()
+        BROADCAST_THROUGHPUT.set(report.throughput)
+        print(f"Broadcast run {run_id} finished: {report.as_dict()}")
+        return report
+
+    async def prepare(self, text: str, minute: Optional[int] = None, include_default: bool = True) -> int:
+        """Enqueue a run ahead of time without sending; returns its id"""
+        run_id = await db.create_broadcast_run(
+            text, status='prepared', minute=minute, include_default=include_default
+        )
+        await self.render_variants(run_id)
+        print(f"Broadcast run {run_id} prepared")
+        return run_id
+
+    async def release(self, run_id: int, text: str) -> Optional[BroadcastReport]:
+        """Send a prepared run with the final text; None if it is no longer prepared"""
+        if not await db.release_broadcast_run(run_id, text):
+            print(f"Broadcast run {run_id} is not prepared, skipping release")
+            return None
+        # Rates may have changed since the warm-up rendered them
+        await self.render_variants(run_id, force=True)
+        return await self.drain(run_id)
+
+    async def send(self, text: str, minute: Optional[int] = None,
+                   include_default: bool = True) -> Optional[BroadcastReport]:
+        """Enqueue a new run and drain it"""
+        run_id = await self.enqueue(text, minute, include_default)
+        return await self.drain(run_id)
+
+    async def purge(self, max_age_hours: float = BROADCAST_RESUME_HOURS) -> int:
+        """Drop finished runs that can no longer be resumed so the outbox does not grow daily"""
+        try:
+            removed = await db.purge_broadcast_runs(max_age_hours)
+        except Exception as e:
+            print(f"Error purging broadcast runs: {e}")
+            return 0
+        if removed:
+            print(f"Purged {removed} finished broadcast runs")
+        return removed
+
+    async def resume(self, max_age_hours: float = BROADCAST_RESUME_HOURS) -> List[int]:
+        """Continue runs interrupted by a restart in the background"""
+        run_ids = await db.get_unfinished_broadcast_runs(max_age_hours)
+        await self.purge(max_age_hours)
+        for run_id in run_ids:
+            print(f"Resuming broadcast run {run_id}")
+            task = asyncio.create_task(self.drain(run_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return run_ids
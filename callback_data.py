@@ -0,0 +1,28 @@
+"""Compact callback data shared by keyboards and handler routes.
+
+Telegram limits callback_data to 64 bytes and every edit resends it for every button,
+so parameterised buttons use short tags followed by their parameters. Currencies are
+identified by their 3-letter code, which is already as short as a numeric id and needs
+no lookup table to decode.
+"""
+MAX_CALLBACK_BYTES = 64
+SEPARATOR = '_'
+
+# Tags of parameterised buttons (legacy long prefixes stay routed for old messages)
+TOGGLE_CURRENCY = 'tc_'
+MY_TOGGLE_CURRENCY = 'my_tc_'
+SHOW_CURRENCY = 'sc_'
+USERS_NEXT = 'un_'
+USERS_PREV = 'up_'
+PICKER_PAGE = 'cp_'
+MY_PICKER_PAGE = 'my_cp_'
+
+# Buttons that only display something (page indicator)
+NOOP = 'noop'
+
+def pack(tag: str, *params) -> str:
+    """Tag followed by underscore-separated parameters"""
+    data = tag + SEPARATOR.join(str(param) for param in params)
+    if len(data.encode('utf-8')) > MAX_CALLBACK_BYTES:
+        raise ValueError(f"Callback data longer than {MAX_CALLBACK_BYTES} bytes: {data}")
+    return data
@@ -0,0 +1,91 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence, Set
+
+from config import CATALOG_POPULAR, CATALOG_PREFIX_LENGTH
+
+@dataclass(frozen=True)
+class CatalogEntry:
+    """One currency with its names in every language the CBU publishes"""
+    code: str
+    name_en: str
+    name_uz: str
+    name_ru: str
+    popular: bool
+    data: Dict[str, Any]
+
+    @property
+    def name(self) -> str:
+        return self.name_en
+
+    def terms(self) -> Set[str]:
+        """Lowercase words a search can start with"""
+        words = {self.code.lower()}
+        for name in (self.name_en, self.name_uz, self.name_ru):
+            words.update(word.strip('()".,').lower() for word in name.split())
+        words.discard('')
+        return words
+
+class CurrencyCatalog:
+    """Currencies of one rate snapshot, popular ones pinned first, with a prefix index.
+
+    Built once per snapshot; search is a few dict lookups. The picker pages available()
+    through keyboards.SelectionLayout.
+    """
+
+    def __init__(self, date: str, currencies: Sequence[Dict[str, Any]],
+                 popular: Sequence[str] = CATALOG_POPULAR):
+        self.date = date
+        rank = {code: index for index, code in enumerate(popular)}
+        entries = [
+            CatalogEntry(
+                code=curr['Ccy'],
+                name_en=curr.get('CcyNm_EN', ''),
+                name_uz=curr.get('CcyNm_UZ', ''),
+                name_ru=curr.get('CcyNm_RU', ''),
+                popular=curr['Ccy'] in rank,
+                data=curr,
+            )
+            for curr in currencies if curr.get('Ccy')
+        ]
+        entries.sort(key=lambda entry: (rank.get(entry.code, len(rank)), entry.code))
+        self.entries: List[CatalogEntry] = entries
+        self.by_code: Dict[str, CatalogEntry] = {entry.code: entry for entry in entries}
+
+        # Prefix -> positions in self.entries (already in display order)
+        self._prefixes: Dict[str, List[int]] = {}
+        for position, entry in enumerate(entries):
+            keys = set()
+            for term in entry.terms():
+                for length in range(1, min(len(term), CATALOG_PREFIX_LENGTH) + 1):
+                    keys.add(term[:length])
+            for key in keys:
+                self._prefixes.setdefault(key, []).append(position)
+
+        self._available = [{'code': entry.code, 'name': entry.name_en} for entry in entries]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def available(self) -> List[Dict[str, str]]:
+        """Code/name list in catalog order, as the keyboards expect"""
+        return self._available
+
+    def search(self, query: str, limit: int) -> List[CatalogEntry]:
+        """Currencies with a code or name word starting with every word of the query"""
+        words = [word.lower() for word in query.split()]
+        if not words:
+            return self.entries[:limit]
+
+        matches = None
+        for word in words:
+            positions = set(self._prefixes.get(word[:CATALOG_PREFIX_LENGTH], ()))
+            if len(word) > CATALOG_PREFIX_LENGTH:
+                # The index stops at CATALOG_PREFIX_LENGTH; check the rest on the few hits
+                positions = {
+                    position for position in positions
+                    if any(term.startswith(word) for term in self.entries[position].terms())
+                }
+            matches = positions if matches is None else matches & positions
+            if not matches:
+                return []
+        return [self.entries[position] for position in sorted(matches)[:limit]]
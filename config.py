@@ -4,14 +4,50 @@ from typing import List
 # Bot configuration
 BOT_TOKEN = os.getenv('BOT_TOKEN', '8212230200:AAE61LLTlS86f2gUOaQ4-cDCKMn6u8t6MEw')
 
+# Update delivery: 'polling' or 'webhook'
+RUN_MODE = os.getenv('RUN_MODE', 'polling')
+ALLOWED_UPDATES = ['message', 'callback_query', 'inline_query']
+
+# Webhook mode (embedded aiohttp server)
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # Public base URL; empty skips setWebhook (local testing)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # Required in webhook mode; checked against X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))  # Pending updates before 503
+WEBHOOK_MAX_CONNECTIONS = 40
+
+# Prometheus metrics endpoint (off by default; local only when enabled)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0') == '1'
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+
 # Admin configuration - Add your Telegram user ID here
 ADMIN_IDS: List[int] = [6237238997]  # Replace with actual admin user IDs
 
 # Database configuration
-DATABASE_PATH = 'bot_database.db'
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'bot_database.db')
+DATABASE_READERS = int(os.getenv('DATABASE_READERS', '4'))  # Read-only connections in the pool
+DATABASE_STATEMENT_CACHE = 256  # Prepared statements cached per connection
+EXPORT_CHUNK_SIZE = 1000  # Users fetched per query when exporting
+USERS_PAGE_SIZE = 20  # Users per page in the admin user browser
+IMPORT_LOOKUP_CHUNK = 500  # Phone keys per IN (...) lookup during track code import
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024  # Bot API download limit for uploaded sheets
+STATS_WINDOWS = (1, 7, 30)  # Registration windows (days) on the statistics screen
+STATS_CHART_DAYS = 7  # Days listed in the per-day registrations breakdown
 
 # API URLs
-CBU_API_URL = 'https://cbu.uz/uz/arkhiv-kursov-valyut/json/all/'
+CBU_API_URL = os.getenv('CBU_API_URL', 'https://cbu.uz/uz/arkhiv-kursov-valyut/json/all/')
+
+# CBU HTTP client
+CBU_CONNECT_TIMEOUT = 5  # Seconds to establish a connection
+CBU_READ_TIMEOUT = 10  # Seconds between received chunks
+CBU_TOTAL_TIMEOUT = 20  # Upper bound for one request
+CBU_MAX_CONNECTIONS = 10
+CBU_DNS_CACHE_TTL = 300
+CBU_KEEPALIVE_TIMEOUT = 60
+CBU_BREAKER_THRESHOLD = 3  # Consecutive failures before requests stop going out
+CBU_BREAKER_COOLDOWN = 60  # Seconds between probes while the breaker is open
 
 # Default settings
 DEFAULT_CURRENCY = 'USD'
@@ -23,4 +59,27 @@ Kurs: {rate} so'm
 Sana: {date}
 
 📊 O'zbekiston Respublikasi Markaziy Banki
-"""
\ No newline at end of file
+"""
+
+# Broadcast limits (Telegram: ~30 msg/s overall, 1 msg/s per chat, 20 msg/min per group)
+BROADCAST_RATE = 30
+BROADCAST_CHAT_INTERVAL = 1.0
+BROADCAST_GROUP_RATE_PER_MINUTE = 20
+BROADCAST_CONCURRENCY = 20
+BROADCAST_MAX_RETRIES = 3
+BROADCAST_BACKOFF_BASE = 1.0
+BROADCAST_BATCH_SIZE = 100  # Outbox rows sent and marked per batch (bounds re-sends after a crash)
+BROADCAST_RESUME_HOURS = 12  # Interrupted runs older than this are not resumed
+BROADCAST_WARMUP_MINUTES = int(os.getenv('BROADCAST_WARMUP_MINUTES', '10'))  # Prepare this long before send_time (0 disables)
+
+# Currency snapshot cache
+CURRENCY_CACHE_TTL = 3600  # Seconds before today's snapshot is re-checked
+CURRENCY_CACHE_DAYS = 31  # Snapshots kept in memory (oldest evicted first)
+BACKFILL_CONCURRENCY = 4  # Parallel CBU requests when backfilling history
+MESSAGE_CACHE_SIZE = 256  # Rendered rate messages kept in memory
+
+# Currency catalog and picker
+CATALOG_POPULAR = ('USD', 'EUR', 'RUB', 'CNY', 'KZT', 'GBP', 'JPY', 'TRY', 'KRW', 'CHF')  # Pinned first
+CATALOG_PREFIX_LENGTH = 8  # Longest indexed prefix of a code or name word
+CATALOG_PAGE_SIZE = 20  # Currencies per picker page
+INLINE_RESULTS_LIMIT = 20  # Inline search results per query (Telegram allows 50)
@@ -0,0 +1,134 @@
+import re
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Any, Callable, Container, Dict, Optional, Sequence
+
+import numpy as np
+from telegram import Message
+from telegram.ext.filters import MessageFilter
+
+BASE_CURRENCY = 'UZS'
+
+# Ways people write the sum in a query
+BASE_ALIASES = {'UZS', 'SUM', 'SOM', "SO'M", 'СУМ'}
+
+# "150 USD EUR", "1 500,5 usd to eur", "200 eur" (target defaults to so'm)
+CONVERSION_PATTERN = re.compile(
+    r"^\s*(?P<amount>\d[\d ]*(?:[.,]\d+)?)\s*(?P<source>[A-Za-z']{3,4}|сум)"
+    r"(?:\s*(?:to|in|ga|->|=)?\s*(?P<target>[A-Za-z']{3,4}|сум))?\s*$",
+    re.IGNORECASE
+)
+
+# Larger amounts would push results past the 28-digit Decimal context when rounded
+MAX_AMOUNT_DIGITS = 15
+MAX_AMOUNT_DECIMALS = 10
+
+@dataclass(frozen=True)
+class Conversion:
+    amount: Decimal
+    source: str
+    target: str
+    result: Decimal
+    rate: Decimal
+
+def parse_query(text: str) -> Optional[tuple]:
+    """(amount, source, target) of a conversion query, None if it is not one"""
+    match = CONVERSION_PATTERN.match(text or '')
+    if not match:
+        return None
+    try:
+        amount = Decimal(match.group('amount').replace(' ', '').replace(',', '.'))
+    except InvalidOperation:
+        return None
+    if amount.adjusted() >= MAX_AMOUNT_DIGITS or -amount.as_tuple().exponent > MAX_AMOUNT_DECIMALS:
+        return None
+    source = _normalize_code(match.group('source'))
+    target = _normalize_code(match.group('target') or BASE_CURRENCY)
+    return amount, source, target
+
+def _normalize_code(code: str) -> str:
+    code = code.upper()
+    return BASE_CURRENCY if code in BASE_ALIASES else code
+
+def round_display(value: Decimal) -> Decimal:
+    """Two decimals, or four significant digits for amounts below one"""
+    if value == 0 or abs(value) >= 1:
+        return value.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    exponent = value.adjusted() - 3
+    return value.quantize(Decimal(1).scaleb(exponent), rounding=ROUND_HALF_UP)
+
+def format_amount(value: Decimal) -> str:
+    """1234567.5 -> '1 234 567.50'"""
+    rounded = round_display(value)
+    if abs(rounded) >= 1:
+        return f"{rounded:,.2f}".replace(',', ' ')
+    return format(rounded, 'f')
+
+class CrossRates:
+    """Every pair of one snapshot's currencies (plus so'm), computed in one vectorized step.
+
+    matrix[i, j] is how many units of currency j one unit of currency i buys. CBU quotes
+    Rate so'm per Nominal units, so the per-unit value is Rate / Nominal.
+    """
+
+    def __init__(self, date: str, currencies: Sequence[Dict[str, Any]]):
+        self.date = date
+        codes = [BASE_CURRENCY]
+        rates = [1.0]
+        for curr in currencies:
+            try:
+                rate = float(curr['Rate']) / float(curr.get('Nominal') or 1)
+            except (KeyError, TypeError, ValueError, ZeroDivisionError):
+                continue
+            if curr.get('Ccy') and rate > 0:
+                codes.append(curr['Ccy'])
+                rates.append(rate)
+
+        self.codes = codes
+        self.index = {code: position for position, code in enumerate(codes)}
+        per_unit = np.array(rates, dtype=np.float64)
+        self.matrix = per_unit[:, np.newaxis] / per_unit[np.newaxis, :]
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.index
+
+    def rate(self, source: str, target: str) -> Optional[Decimal]:
+        """Units of target per unit of source, None for an unknown code"""
+        i = self.index.get(source)
+        j = self.index.get(target)
+        if i is None or j is None:
+            return None
+        # repr gives the shortest decimal that round-trips the float
+        return Decimal(repr(float(self.matrix[i, j])))
+
+    def convert(self, amount: Decimal, source: str, target: str) -> Optional[Conversion]:
+        rate = self.rate(source, target)
+        if rate is None:
+            return None
+        return Conversion(amount, source, target, amount * rate, rate)
+
+def render_conversion(conversion: Conversion, stale_date: Optional[str] = None) -> str:
+    """Conversion result as a Markdown message"""
+    text = (
+        f"💱 **{format_amount(conversion.amount)} {conversion.source}** = "
+        f"**{format_amount(conversion.result)} {conversion.target}**\n\n"
+        f"1 {conversion.source} = {format_amount(conversion.rate)} {conversion.target}"
+    )
+    if stale_date:
+        text += f"\n⚠️ {stale_date} holatidagi kurs bo'yicha"
+    return text + "\n📊 O'zbekiston Respublikasi Markaziy Banki"
+
+class ConversionFilter(MessageFilter):
+    """Conversion queries whose codes are all known, so "5 kun" stays ordinary text"""
+    __slots__ = ('known_codes',)
+
+    def __init__(self, known_codes: Callable[[], Container[str]]):
+        self.known_codes = known_codes
+        super().__init__(name='ConversionFilter')
+
+    def filter(self, message: Message) -> bool:
+        parsed = parse_query(message.text)
+        if parsed is None:
+            return False
+        codes = self.known_codes()
+        return parsed[1] in codes and parsed[2] in codes
@@ -1,52 +1,351 @@
 import aiohttp
 import asyncio
-from datetime import datetime
+import itertools
+import time
+from collections import OrderedDict
+from datetime import datetime, date as date_cls, timedelta
 from typing import List, Dict, Any, Optional
-from config import CBU_API_URL
+from catalog import CurrencyCatalog
+from converter import CrossRates
+from database import db
+from metrics import CBU_FETCH_SECONDS
+from config import (
+    CBU_API_URL, CURRENCY_CACHE_TTL, CURRENCY_CACHE_DAYS, BACKFILL_CONCURRENCY,
+    CBU_CONNECT_TIMEOUT, CBU_READ_TIMEOUT, CBU_TOTAL_TIMEOUT,
+    CBU_MAX_CONNECTIONS, CBU_DNS_CACHE_TTL, CBU_KEEPALIVE_TIMEOUT,
+    CBU_BREAKER_THRESHOLD, CBU_BREAKER_COOLDOWN
+)
+
+class RateSnapshot:
+    """Parsed CBU payload for one date, indexed by currency code"""
+
+    # Increases for every parsed payload so caches can tell snapshots apart
+    _serials = itertools.count(1)
+
+    def __init__(self, date: str, currencies: List[Dict[str, Any]],
+                 etag: Optional[str] = None, last_modified: Optional[str] = None):
+        self.date = date
+        self.currencies = currencies
+        self.by_code = {curr['Ccy']: curr for curr in currencies if curr.get('Ccy')}
+        self.etag = etag
+        self.last_modified = last_modified
+        self.serial = next(self._serials)
+        self.fetched_at = time.monotonic()
+        self._available: Optional[List[Dict[str, str]]] = None
+        self._catalog: Optional[CurrencyCatalog] = None
+        self._cross_rates: Optional[CrossRates] = None
+
+    def touch(self):
+        """Mark the snapshot as confirmed unchanged by the server"""
+        self.fetched_at = time.monotonic()
+
+    def is_fresh(self, ttl: float = CURRENCY_CACHE_TTL) -> bool:
+        """Past dates never change; today's rates are re-checked after ttl"""
+        if self.date != datetime.now().strftime('%Y-%m-%d'):
+            return True
+        return time.monotonic() - self.fetched_at < ttl
+
+    def available(self) -> List[Dict[str, str]]:
+        """Code/name/rate list built once per snapshot"""
+        if self._available is None:
+            self._available = [
+                {
+                    'code': curr.get('Ccy', ''),
+                    'name': curr.get('CcyNm_EN', ''),
+                    'rate': curr.get('Rate', '0')
+                }
+                for curr in self.currencies if curr.get('Ccy')
+            ]
+        return self._available
+
+    def catalog(self) -> CurrencyCatalog:
+        """Search and paging index built once per snapshot"""
+        if self._catalog is None:
+            self._catalog = CurrencyCatalog(self.date, self.currencies)
+        return self._catalog
+
+    def cross_rates(self) -> CrossRates:
+        """Conversion matrix of every currency pair, built once per snapshot"""
+        if self._cross_rates is None:
+            self._cross_rates = CrossRates(self.date, self.currencies)
+        return self._cross_rates
+
+    def is_stale_for(self, date: str) -> bool:
+        """True when served in place of a date that could not be fetched"""
+        return self.date != date
+
+class CircuitBreaker:
+    """Stop calling an upstream after repeated failures, then probe it once per cooldown"""
+
+    def __init__(self, threshold: int = CBU_BREAKER_THRESHOLD, cooldown: float = CBU_BREAKER_COOLDOWN):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.failures = 0
+        self._open_until = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return self.failures >= self.threshold
+
+    def allow(self) -> bool:
+        """Whether a request may go out now; an open breaker lets one probe through per cooldown"""
+        if not self.is_open:
+            return True
+        now = time.monotonic()
+        if now < self._open_until:
+            return False
+        # Half-open: this caller probes, everyone else keeps failing fast until it reports back
+        self._open_until = now + self.cooldown
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self._open_until = 0.0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures == self.threshold:
+            print(f"CBU circuit opened after {self.failures} failures")
+        if self.is_open:
+            self._open_until = time.monotonic() + self.cooldown
 
 class CurrencyAPI:
     def __init__(self):
         self.base_url = CBU_API_URL
+        self._snapshots: "OrderedDict[str, RateSnapshot]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.breaker = CircuitBreaker()
 
-    async def get_currency_data(self, date: str = None) -> List[Dict[str, Any]]:
-        """Fetch currency data from CBU API"""
-        if not date:
-            date = datetime.now().strftime('%Y-%m-%d')
-        
+    async def open(self) -> aiohttp.ClientSession:
+        """Create the shared HTTP session (keep-alive, DNS cache, timeouts)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=CBU_MAX_CONNECTIONS,
+                ttl_dns_cache=CBU_DNS_CACHE_TTL,
+                keepalive_timeout=CBU_KEEPALIVE_TIMEOUT
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=CBU_TOTAL_TIMEOUT,
+                connect=CBU_CONNECT_TIMEOUT,
+                sock_read=CBU_READ_TIMEOUT
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=timeout,
+                headers={'Accept': 'application/json', 'Accept-Encoding': 'gzip, deflate'}
+            )
+        return self._session
+
+    async def close(self):
+        """Close the shared HTTP session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _fetch(self, date: str, cached: Optional[RateSnapshot] = None) -> Optional[RateSnapshot]:
+        """Download one date, revalidating the cached copy with ETag/Last-Modified"""
         url = f"{self.base_url}{date}/"
-        
+
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+
+        # Fail fast instead of paying a full timeout per request while CBU is down
+        if not self.breaker.allow():
+            CBU_FETCH_SECONDS.observe(0.0, 'circuit_open')
+            return None
+
+        started = time.perf_counter()
+        status = 'error'
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data
-                    else:
-                        print(f"API request failed with status: {response.status}")
-                        return []
+            session = await self.open()
+            async with session.get(url, headers=headers) as response:
+                status = str(response.status)
+                if response.status >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if response.status == 304 and cached is not None:
+                    cached.touch()
+                    return cached
+                if response.status == 200:
+                    data = await response.json(content_type=None)
+                    if not data:
+                        return None
+                    return RateSnapshot(
+                        date, data,
+                        etag=response.headers.get('ETag'),
+                        last_modified=response.headers.get('Last-Modified')
+                    )
+                else:
+                    print(f"API request failed with status: {response.status}")
+                    return None
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            self.breaker.record_failure()
+            print(f"Timed out fetching currency data for {date}")
+            return None
         except Exception as e:
+            self.breaker.record_failure()
             print(f"Error fetching currency data: {e}")
-            return []
+            return None
+        finally:
+            CBU_FETCH_SECONDS.observe(time.perf_counter() - started, status)
+
+    def _store(self, snapshot: RateSnapshot):
+        """Keep the snapshot and evict the oldest ones beyond CURRENCY_CACHE_DAYS"""
+        self._snapshots[snapshot.date] = snapshot
+        self._snapshots.move_to_end(snapshot.date)
+        # Computed as soon as rates arrive so conversions only index the matrix
+        snapshot.cross_rates()
+        while len(self._snapshots) > CURRENCY_CACHE_DAYS:
+            self._snapshots.popitem(last=False)
+
+    async def _download(self, date: str) -> Optional[RateSnapshot]:
+        """Fetch one date, persist new payloads and cache the parsed snapshot"""
+        cached = self._snapshots.get(date)
+        snapshot = await self._fetch(date, cached)
+        if snapshot is None:
+            return None
+        if snapshot is not cached:
+            await db.save_rates(date, snapshot.currencies)
+        self._store(snapshot)
+        return snapshot
+
+    async def _load_stored(self, date: str) -> Optional[RateSnapshot]:
+        """Build a snapshot from the rates table without touching the network"""
+        try:
+            currencies = await db.get_rates(date)
+        except Exception as e:
+            print(f"Error reading stored rates for {date}: {e}")
+            return None
+        if not currencies:
+            return None
+        snapshot = RateSnapshot(date, currencies)
+        self._store(snapshot)
+        return snapshot
+
+    def _start_load(self, date: str) -> asyncio.Task:
+        """Fetch and cache one date, sharing the request between concurrent callers"""
+        task = self._inflight.get(date)
+        if task is None:
+            task = asyncio.ensure_future(self._download(date))
+            self._inflight[date] = task
+            task.add_done_callback(lambda _: self._inflight.pop(date, None))
+        return task
+
+    async def _load(self, date: str) -> Optional[RateSnapshot]:
+        return await asyncio.shield(self._start_load(date))
+
+    async def _latest_before(self, date: str) -> Optional[RateSnapshot]:
+        """Newest snapshot older than date, from memory or the rates table"""
+        cached = [day for day in self._snapshots if day < date]
+        try:
+            stored = await db.get_latest_rate_date(date)
+        except Exception as e:
+            print(f"Error reading stored rate dates: {e}")
+            stored = None
+        latest = max(cached + ([stored] if stored else []), default=None)
+        if latest is None:
+            return None
+        return self._snapshots.get(latest) or await self._load_stored(latest)
+
+    async def get_snapshot(self, date: str = None, wait: bool = False) -> Optional[RateSnapshot]:
+        """Snapshot for the date, served stale-while-revalidate.
+
+        A cached or stored copy (or the newest earlier date) is returned immediately
+        while a background refresh runs; only wait=True or an empty cache blocks on
+        the network. Check snapshot.is_stale_for(date) to flag older rates.
+        """
+        if not date:
+            date = datetime.now().strftime('%Y-%m-%d')
+
+        snapshot = self._snapshots.get(date)
+        if snapshot is None:
+            snapshot = await self._load_stored(date)
+        if snapshot and snapshot.is_fresh():
+            return snapshot
+
+        fallback = snapshot or await self._latest_before(date)
+        if fallback is None or wait:
+            fresh = await self._load(date)
+            return fresh or fallback
+
+        self._start_load(date)
+        return fallback
+
+    async def refresh(self, date: str = None) -> Optional[RateSnapshot]:
+        """Download the snapshot again regardless of its age"""
+        if not date:
+            date = datetime.now().strftime('%Y-%m-%d')
+        return await self._load(date) or self._snapshots.get(date)
+
+    async def get_currency_data(self, date: str = None) -> List[Dict[str, Any]]:
+        """Fetch currency data from CBU API"""
+        snapshot = await self.get_snapshot(date)
+        return snapshot.currencies if snapshot else []
 
     async def get_currency_by_code(self, code: str, date: str = None) -> Optional[Dict[str, Any]]:
         """Get specific currency by code"""
-        currencies = await self.get_currency_data(date)
-        for currency in currencies:
-            if currency.get('Ccy') == code:
-                return currency
-        return None
+        snapshot = await self.get_snapshot(date)
+        return snapshot.by_code.get(code) if snapshot else None
+
+    async def get_catalog(self) -> Optional[CurrencyCatalog]:
+        """Catalog of the current snapshot"""
+        snapshot = await self.get_snapshot()
+        return snapshot.catalog() if snapshot else None
+
+    def cached_snapshot(self) -> Optional[RateSnapshot]:
+        """Newest snapshot in memory, never waiting on I/O.
+
+        With nothing cached yet a background load is started for the next caller.
+        """
+        if not self._snapshots:
+            self._start_load(datetime.now().strftime('%Y-%m-%d'))
+            return None
+        return self._snapshots[max(self._snapshots)]
+
+    def cached_catalog(self) -> Optional[CurrencyCatalog]:
+        """Catalog of the newest snapshot in memory"""
+        snapshot = self.cached_snapshot()
+        return snapshot.catalog() if snapshot else None
 
     async def get_available_currencies(self) -> List[Dict[str, str]]:
         """Get list of available currencies with codes and names"""
-        currencies = await self.get_currency_data()
-        return [
-            {
-                'code': curr.get('Ccy', ''),
-                'name': curr.get('CcyNm_EN', ''),
-                'rate': curr.get('Rate', '0')
-            }
-            for curr in currencies if curr.get('Ccy')
+        snapshot = await self.get_snapshot()
+        return snapshot.available() if snapshot else []
+
+    async def backfill(self, start: str, end: str, concurrency: int = BACKFILL_CONCURRENCY) -> Dict[str, int]:
+        """Download and store every missing date between start and end (YYYY-MM-DD)"""
+        first = date_cls.fromisoformat(start)
+        last = date_cls.fromisoformat(end)
+        stored = set(await db.get_rate_dates(start, end))
+        dates = [
+            (first + timedelta(days=offset)).isoformat()
+            for offset in range((last - first).days + 1)
         ]
+        missing = [day for day in dates if day not in stored]
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def fetch_day(day: str) -> int:
+            async with semaphore:
+                snapshot = await self._fetch(day)
+                if snapshot is None:
+                    return -1
+                return await db.save_rates(day, snapshot.currencies)
+
+        results = await asyncio.gather(*(fetch_day(day) for day in missing))
+        return {
+            'days': len(dates),
+            'skipped': len(dates) - len(missing),
+            'fetched': sum(1 for count in results if count > 0),
+            'failed': sum(1 for count in results if count <= 0),
+            'rows': sum(count for count in results if count > 0)
+        }
 
     def format_currency_info(self, currency_data: Dict[str, Any], template: str) -> str:
         """Format currency information using template"""
@@ -62,4 +361,4 @@ class CurrencyAPI:
             return f"Currency: {currency_data.get('Ccy', 'Unknown')}\nRate: {currency_data.get('Rate', '0')} UZS"
 
 # Global currency API instance
-currency_api = CurrencyAPI()
\ No newline at end of file
+currency_api = CurrencyAPI()
@@ -1,151 +1,759 @@
 import aiosqlite
 import asyncio
-from datetime import datetime
-from typing import Optional, List, Dict, Any
-from config import DATABASE_PATH, DEFAULT_CURRENCY, DEFAULT_SEND_TIME, DEFAULT_TEMPLATE
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, replace
+from datetime import datetime, date as date_cls, timedelta
+from typing import Optional, List, Dict, Any, AsyncIterator, Iterable, Sequence, Set, Tuple, Union
+from config import (
+    DATABASE_PATH, DATABASE_READERS, DATABASE_STATEMENT_CACHE, EXPORT_CHUNK_SIZE, USERS_PAGE_SIZE,
+    IMPORT_LOOKUP_CHUNK, STATS_WINDOWS, STATS_CHART_DAYS,
+    BROADCAST_BATCH_SIZE,
+    DEFAULT_CURRENCY, DEFAULT_SEND_TIME, DEFAULT_TEMPLATE
+)
+from metrics import DB_SECONDS, DB_ERRORS, instrument_methods
+from migrations import migrate
+from phones import normalize_phone
 
+# Pragmas applied to every pooled connection
+CONNECTION_PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 134217728',
+    'PRAGMA foreign_keys = ON',
+    # INSERT OR REPLACE must fire the users delete trigger to keep the stats counters right
+    'PRAGMA recursive_triggers = ON',
+]
+
+SETTINGS_FIELDS = ('currency', 'send_time', 'template')
+SETTINGS_LIST_FIELDS = ('selected_currencies', 'channels')
+
+def split_list(value: Union[str, Sequence[str], None]) -> Tuple[str, ...]:
+    """Normalize a comma-joined string or a sequence into clean unique items"""
+    if not value:
+        return ()
+    items = value.split(',') if isinstance(value, str) else value
+    result = []
+    for item in items:
+        item = str(item).strip()
+        if item and item not in result:
+            result.append(item)
+    return tuple(result)
+
+def parse_send_minute(value: str) -> Optional[int]:
+    """HH:MM to minute of the day, None if malformed"""
+    try:
+        parsed = datetime.strptime(value.strip(), '%H:%M')
+    except ValueError:
+        return None
+    return parsed.hour * 60 + parsed.minute
+
+def subscription_key(codes: Iterable[str]) -> Optional[str]:
+    """Order-independent key of a currency set, None when empty"""
+    return ','.join(sorted(set(codes))) or None
+
+def format_send_minute(minute: int) -> str:
+    """Minute of the day as HH:MM"""
+    return f'{minute // 60:02d}:{minute % 60:02d}'
+
+@dataclass(frozen=True)
+class Settings:
+    """Bot settings with list fields already parsed"""
+    currency: str = DEFAULT_CURRENCY
+    selected_currencies: Tuple[str, ...] = (DEFAULT_CURRENCY,)
+    send_time: str = DEFAULT_SEND_TIME
+    template: str = DEFAULT_TEMPLATE
+    channels: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any], selected_currencies: Sequence[str] = (DEFAULT_CURRENCY,),
+                 channels: Sequence[str] = ()) -> 'Settings':
+        return cls(
+            currency=row.get('currency') or DEFAULT_CURRENCY,
+            selected_currencies=tuple(selected_currencies),
+            send_time=row.get('send_time') or DEFAULT_SEND_TIME,
+            template=row.get('template') or DEFAULT_TEMPLATE,
+            channels=tuple(channels)
+        )
+
+    def updated(self, **values) -> 'Settings':
+        """Copy with new values applied"""
+        return replace(self, **values)
+
+    @property
+    def send_minute(self) -> int:
+        """Global send_time as minute of the day"""
+        minute = parse_send_minute(self.send_time)
+        return minute if minute is not None else parse_send_minute(DEFAULT_SEND_TIME)
+
+# open/close are connection lifecycle and would skew the per-query timings
+@instrument_methods(DB_SECONDS, DB_ERRORS, exclude=('open', 'close'))
 class Database:
-    def __init__(self, db_path: str = DATABASE_PATH):
+    def __init__(self, db_path: str = DATABASE_PATH, readers: int = DATABASE_READERS):
         self.db_path = db_path
+        self.readers = max(1, readers)
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._reader_conns: List[aiosqlite.Connection] = []
+        self._reader_pool: Optional[asyncio.Queue] = None
+        self._write_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+        self._settings: Optional[Settings] = None
+        self._user_count: Optional[int] = None
+
+    async def _connect(self, readonly: bool = False) -> aiosqlite.Connection:
+        """Open one tuned connection for the pool"""
+        conn = await aiosqlite.connect(self.db_path, cached_statements=DATABASE_STATEMENT_CACHE)
+        conn.row_factory = aiosqlite.Row
+        for pragma in CONNECTION_PRAGMAS:
+            await conn.execute(pragma)
+        if readonly:
+            await conn.execute('PRAGMA query_only = 1')
+        return conn
+
+    async def open(self):
+        """Open the writer and reader connections once"""
+        if self._writer is not None:
+            return
+        async with self._open_lock:
+            if self._writer is not None:
+                return
+            # Writer first so WAL mode is set before readers attach
+            writer = await self._connect()
+            pool = asyncio.Queue()
+            for _ in range(self.readers):
+                conn = await self._connect(readonly=True)
+                self._reader_conns.append(conn)
+                pool.put_nowait(conn)
+            self._reader_pool = pool
+            self._writer = writer
+
+    async def close(self):
+        """Close all pooled connections"""
+        async with self._open_lock:
+            if self._writer is None:
+                return
+            async with self._write_lock:
+                for conn in self._reader_conns:
+                    await conn.close()
+                await self._writer.execute('PRAGMA optimize')
+                await self._writer.close()
+            self._reader_conns = []
+            self._reader_pool = None
+            self._writer = None
+
+    @asynccontextmanager
+    async def _read(self):
+        """Borrow a read-only connection from the pool"""
+        await self.open()
+        pool = self._reader_pool
+        conn = await pool.get()
+        try:
+            yield conn
+        finally:
+            pool.put_nowait(conn)
+
+    @asynccontextmanager
+    async def _write(self):
+        """Hold the single writer connection for one transaction"""
+        await self.open()
+        async with self._write_lock:
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except Exception:
+                await self._writer.rollback()
+                raise
 
     async def init_db(self):
-        """Initialize database tables"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Users table
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY,
-                    user_id INTEGER UNIQUE NOT NULL,
-                    fullname TEXT NOT NULL,
-                    phone TEXT NOT NULL,
-                    track_code TEXT,
-                    reg_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT 1
-                )
-            ''')
-            
-            # Settings table
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS settings (
-                    id INTEGER PRIMARY KEY,
-                    currency TEXT DEFAULT 'USD',
-                    selected_currencies TEXT DEFAULT 'USD',
-                    send_time TEXT DEFAULT '09:00',
-                    template TEXT DEFAULT '',
-                    channels TEXT DEFAULT ''
-                )
-            ''')
-            
-            # Insert default settings if not exists
-            await db.execute('''
-                INSERT OR IGNORE INTO settings (id, currency, selected_currencies, send_time, template, channels)
-                VALUES (1, ?, ?, ?, ?, '')
-            ''', (DEFAULT_CURRENCY, DEFAULT_CURRENCY, DEFAULT_SEND_TIME, DEFAULT_TEMPLATE))
-            
-            await db.commit()
+        """Initialize database tables and apply pending migrations"""
+        async with self._write() as db:
+            version = await migrate(db)
+        print(f"Database schema version: {version}")
+
+        self.invalidate_settings()
 
     async def add_user(self, user_id: int, fullname: str, phone: str) -> bool:
         """Add new user to database"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._write() as db:
                 await db.execute('''
-                    INSERT OR REPLACE INTO users (user_id, fullname, phone, reg_date)
-                    VALUES (?, ?, ?, ?)
-                ''', (user_id, fullname, phone, datetime.now()))
-                await db.commit()
-                return True
+                    INSERT OR REPLACE INTO users (user_id, fullname, phone, phone_key, reg_date)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (user_id, fullname, phone, normalize_phone(phone), datetime.now()))
+            self._user_count = None
+            return True
         except Exception as e:
             print(f"Error adding user: {e}")
             return False
 
     async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Get user by user_id"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute('''
+        async with self._read() as db:
+            rows = await db.execute_fetchall('''
                 SELECT * FROM users WHERE user_id = ?
-            ''', (user_id,)) as cursor:
-                row = await cursor.fetchone()
-                return dict(row) if row else None
+            ''', (user_id,))
+            return dict(rows[0]) if rows else None
 
     async def get_user_by_phone(self, phone: str) -> Optional[Dict[str, Any]]:
-        """Get user by phone number"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute('''
-                SELECT * FROM users WHERE phone = ?
-            ''', (phone,)) as cursor:
-                row = await cursor.fetchone()
-                return dict(row) if row else None
+        """Get user by phone number in any format"""
+        phone_key = normalize_phone(phone)
+        if not phone_key:
+            return None
+        async with self._read() as db:
+            rows = await db.execute_fetchall('''
+                SELECT * FROM users WHERE phone_key = ?
+            ''', (phone_key,))
+            return dict(rows[0]) if rows else None
 
     async def update_track_code(self, phone: str, track_code: str) -> bool:
         """Update track code for user by phone"""
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._write() as db:
                 await db.execute('''
-                    UPDATE users SET track_code = ? WHERE phone = ?
-                ''', (track_code, phone))
-                await db.commit()
+                    UPDATE users SET track_code = ? WHERE phone_key = ?
+                ''', (track_code, normalize_phone(phone)))
                 return True
         except Exception as e:
             print(f"Error updating track code: {e}")
             return False
 
+    async def get_existing_phone_keys(self, phone_keys: Iterable[str]) -> Set[str]:
+        """Which of the given canonical phone keys belong to registered users"""
+        keys = list(phone_keys)
+        found = set()
+        async with self._read() as db:
+            for start in range(0, len(keys), IMPORT_LOOKUP_CHUNK):
+                chunk = keys[start:start + IMPORT_LOOKUP_CHUNK]
+                placeholders = ','.join('?' * len(chunk))
+                rows = await db.execute_fetchall(
+                    f'SELECT phone_key FROM users WHERE phone_key IN ({placeholders})', chunk
+                )
+                found.update(row[0] for row in rows)
+        return found
+
+    async def update_track_codes(self, codes: Sequence[Tuple[str, str]]) -> int:
+        """Set many (track_code, phone_key) pairs in one transaction"""
+        if not codes:
+            return 0
+        async with self._write() as db:
+            cursor = await db.executemany(
+                'UPDATE users SET track_code = ? WHERE phone_key = ?', codes
+            )
+            return cursor.rowcount
+
     async def get_all_users(self) -> List[Dict[str, Any]]:
         """Get all users"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute('SELECT * FROM users ORDER BY reg_date DESC') as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
-
-    async def get_user_stats(self) -> Dict[str, int]:
-        """Get user statistics"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Total users
-            async with db.execute('SELECT COUNT(*) FROM users') as cursor:
-                total_users = (await cursor.fetchone())[0]
-            
-            # Active users (registered in last 30 days)
-            async with db.execute('''
-                SELECT COUNT(*) FROM users 
-                WHERE reg_date >= datetime('now', '-30 days')
-            ''') as cursor:
-                active_users = (await cursor.fetchone())[0]
-            
-            return {
-                'total_users': total_users,
-                'active_users': active_users
-            }
-
-    async def get_settings(self) -> Dict[str, Any]:
-        """Get bot settings"""
+        async with self._read() as db:
+            rows = await db.execute_fetchall('SELECT * FROM users ORDER BY reg_date DESC')
+            return [dict(row) for row in rows]
+
+    async def get_users_page(self, anchor_id: Optional[int] = None, backwards: bool = False,
+                             limit: int = USERS_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], bool]:
+        """One page of users, newest first, keyset-paginated on (reg_date, id).
+
+        Returns the page and whether more rows exist past it in the same direction.
+        """
+        if anchor_id is None:
+            query = '''
+                SELECT * FROM users ORDER BY reg_date DESC, id DESC LIMIT ?
+            '''
+            params = (limit + 1,)
+        elif backwards:
+            query = '''
+                SELECT * FROM users
+                WHERE (reg_date, id) > (SELECT reg_date, id FROM users WHERE id = ?)
+                ORDER BY reg_date, id LIMIT ?
+            '''
+            params = (anchor_id, limit + 1)
+        else:
+            query = '''
+                SELECT * FROM users
+                WHERE (reg_date, id) < (SELECT reg_date, id FROM users WHERE id = ?)
+                ORDER BY reg_date DESC, id DESC LIMIT ?
+            '''
+            params = (anchor_id, limit + 1)
+
+        async with self._read() as db:
+            rows = await db.execute_fetchall(query, params)
+
+        has_more = len(rows) > limit
+        users = [dict(row) for row in rows[:limit]]
+        if backwards:
+            users.reverse()
+        return users, has_more
+
+    async def count_users(self) -> int:
+        """Total number of users, cached until the next registration"""
+        if self._user_count is None:
+            async with self._read() as db:
+                rows = await db.execute_fetchall("SELECT value FROM user_counters WHERE name = 'total'")
+            self._user_count = rows[0][0] if rows else 0
+        return self._user_count
+
+    async def iter_users(self, chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield users in id order, one chunk per query"""
+        last_id = 0
+        while True:
+            async with self._read() as db:
+                rows = await db.execute_fetchall('''
+                    SELECT * FROM users WHERE id > ? ORDER BY id LIMIT ?
+                ''', (last_id, chunk_size))
+            if not rows:
+                return
+            last_id = rows[-1]['id']
+            yield [dict(row) for row in rows]
+
+    async def get_export_summary(self) -> Dict[str, int]:
+        """User count and longest value per exported column, in one scan"""
+        async with self._read() as db:
+            rows = await db.execute_fetchall('''
+                SELECT COUNT(*) AS total,
+                       COALESCE(MAX(LENGTH(fullname)), 0) AS fullname,
+                       COALESCE(MAX(LENGTH(phone_key)), 0) AS phone,
+                       COALESCE(MAX(LENGTH(track_code)), 0) AS track_code
+                FROM users
+            ''')
+            return dict(rows[0])
+
+    async def get_user_stats(self, windows: Sequence[int] = STATS_WINDOWS) -> Dict[str, int]:
+        """User counters plus registrations in the last N days, from the rollup tables"""
+        async with self._read() as db:
+            rows = await db.execute_fetchall('SELECT name, value FROM user_counters')
+            counters = {row['name']: row['value'] for row in rows}
+
+            # Days are stored in local time, the same clock add_user writes reg_date with
+            oldest = max(windows)
+            rows = await db.execute_fetchall('''
+                SELECT day, registrations FROM daily_stats
+                WHERE day > date('now', 'localtime', ?)
+            ''', (f'-{oldest} days',))
+
+        today = datetime.now().date()
+        stats = {
+            'total_users': counters.get('total', 0),
+            'active_users': counters.get('active', 0),
+            'inactive_users': counters.get('total', 0) - counters.get('active', 0),
+            'with_track_code': counters.get('with_track_code', 0),
+        }
+        for days in windows:
+            stats[f'registered_{days}d'] = sum(
+                row['registrations'] for row in rows
+                if (today - date_cls.fromisoformat(row['day'])).days < days
+            )
+        return stats
+
+    async def get_daily_stats(self, days: int = STATS_CHART_DAYS) -> List[Dict[str, Any]]:
+        """Registrations and newly assigned track codes per day, oldest first, gaps filled with zeros"""
+        async with self._read() as db:
+            rows = await db.execute_fetchall('''
+                SELECT day, registrations, track_codes FROM daily_stats
+                WHERE day > date('now', 'localtime', ?)
+            ''', (f'-{days} days',))
+        by_day = {row['day']: dict(row) for row in rows}
+
+        today = datetime.now().date()
+        result = []
+        for offset in range(days - 1, -1, -1):
+            day = (today - timedelta(days=offset)).isoformat()
+            result.append(by_day.get(day, {'day': day, 'registrations': 0, 'track_codes': 0}))
+        return result
+
+    async def get_settings(self) -> Settings:
+        """Get bot settings (served from memory after the first load)"""
+        if self._settings is not None:
+            return self._settings
+
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
-                async with db.execute('SELECT * FROM settings WHERE id = 1') as cursor:
-                    row = await cursor.fetchone()
-                    result = dict(row) if row else {}
-                    print(f"Database settings result: {result}")
-                    return result
+            async with self._read() as db:
+                rows = await db.execute_fetchall('SELECT * FROM settings WHERE id = 1')
+                currencies = await db.execute_fetchall(
+                    'SELECT code FROM selected_currencies ORDER BY position'
+                )
+                channels = await db.execute_fetchall('SELECT chat_id FROM channels ORDER BY id')
+            self._settings = Settings.from_row(
+                dict(rows[0]) if rows else {},
+                selected_currencies=[row[0] for row in currencies],
+                channels=[row[0] for row in channels]
+            )
+            return self._settings
         except Exception as e:
             print(f"Error getting settings: {e}")
-            return {}
+            return Settings()
+
+    def invalidate_settings(self):
+        """Drop cached settings so the next read goes to the database"""
+        self._settings = None
 
     async def update_settings(self, **kwargs) -> bool:
         """Update bot settings"""
+        values = {}
+        for key, value in kwargs.items():
+            if key in SETTINGS_LIST_FIELDS:
+                values[key] = split_list(value)
+            elif key in SETTINGS_FIELDS:
+                values[key] = value
+
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                for key, value in kwargs.items():
-                    if key in ['currency', 'selected_currencies', 'send_time', 'template', 'channels']:
+            async with self._write() as db:
+                for key, value in values.items():
+                    if key == 'selected_currencies':
+                        await db.execute('DELETE FROM selected_currencies')
+                        await db.executemany(
+                            'INSERT INTO selected_currencies (code, position) VALUES (?, ?)',
+                            [(code, position) for position, code in enumerate(value)]
+                        )
+                    elif key == 'channels':
+                        await db.execute('DELETE FROM channels')
+                        await db.executemany(
+                            'INSERT INTO channels (chat_id) VALUES (?)',
+                            [(channel,) for channel in value]
+                        )
+                    else:
                         await db.execute(f'''
                             UPDATE settings SET {key} = ? WHERE id = 1
                         ''', (value,))
-                await db.commit()
-                return True
         except Exception as e:
             print(f"Error updating settings: {e}")
+            self.invalidate_settings()
+            return False
+
+        # Write-through: patch the cached copy instead of reloading it
+        if self._settings is not None and values:
+            self._settings = self._settings.updated(**values)
+        return True
+
+    async def add_channel(self, chat_id: str) -> bool:
+        """Add one channel; returns False if it was already configured"""
+        try:
+            async with self._write() as db:
+                cursor = await db.execute(
+                    'INSERT OR IGNORE INTO channels (chat_id) VALUES (?)', (chat_id,)
+                )
+                added = cursor.rowcount > 0
+        except Exception as e:
+            print(f"Error adding channel: {e}")
+            return False
+
+        if added and self._settings is not None:
+            self._settings = self._settings.updated(channels=self._settings.channels + (chat_id,))
+        return added
+
+    async def remove_channel(self, chat_id: str) -> bool:
+        """Remove one channel; returns False if it was not configured"""
+        try:
+            async with self._write() as db:
+                cursor = await db.execute('DELETE FROM channels WHERE chat_id = ?', (chat_id,))
+                removed = cursor.rowcount > 0
+        except Exception as e:
+            print(f"Error removing channel: {e}")
+            return False
+
+        if removed and self._settings is not None:
+            self._settings = self._settings.updated(
+                channels=tuple(ch for ch in self._settings.channels if ch != chat_id)
+            )
+        return removed
+
+    @staticmethod
+    def _recipient_filter(minute: Optional[int], include_default: bool) -> Tuple[str, tuple]:
+        """WHERE clause picking users/channels of one delivery minute (None means everyone)"""
+        if minute is None:
+            return '1', ()
+        if include_default:
+            return '(send_minute = ? OR send_minute IS NULL)', (minute,)
+        return 'send_minute = ?', (minute,)
+
+    async def create_broadcast_run(self, text: str, status: str = 'running',
+                                   minute: Optional[int] = None, include_default: bool = True) -> int:
+        """Create a broadcast run and enqueue its users and channels.
+
+        minute limits the run to recipients whose send_minute matches; include_default
+        also takes those without their own time. A run created as 'prepared' is neither
+        resumed nor sent until release_broadcast_run.
+        """
+        async with self._write() as db:
+            cursor = await db.execute('''
+                INSERT INTO broadcast_runs (text, status, send_minute, include_default, user_watermark)
+                VALUES (?, ?, ?, ?, 0)
+            ''', (text, status, minute, int(include_default)))
+            run_id = cursor.lastrowid
+            await self._enqueue_recipients(db, run_id, minute, include_default)
+            return run_id
+
+    async def release_broadcast_run(self, run_id: int, text: str) -> bool:
+        """Start a prepared run with the final text, adding recipients who appeared since it was prepared"""
+        async with self._write() as db:
+            cursor = await db.execute('''
+                UPDATE broadcast_runs SET status = 'running', text = ?
+                WHERE id = ? AND status = 'prepared'
+            ''', (text, run_id))
+            if cursor.rowcount == 0:
+                return False
+            rows = await db.execute_fetchall('''
+                SELECT send_minute, include_default, user_watermark FROM broadcast_runs WHERE id = ?
+            ''', (run_id,))
+            minute, include_default, watermark = rows[0]
+            await self._enqueue_recipients(db, run_id, minute, bool(include_default), watermark)
+            return True
+
+    @classmethod
+    async def _enqueue_recipients(cls, db: aiosqlite.Connection, run_id: int, minute: Optional[int],
+                                  include_default: bool, after_user: int = 0):
+        """Add matching users (past the watermark) and channels to a run and refresh its total"""
+        where, params = cls._recipient_filter(minute, include_default)
+        await db.execute(f'''
+            INSERT OR IGNORE INTO outbox (run_id, chat_id, variant)
+            SELECT ?, user_id, subscription FROM users WHERE id > ? AND {where} ORDER BY id
+        ''', (run_id, after_user) + params)
+        # One digest per distinct subscription, rendered before the run is drained
+        await db.execute(f'''
+            INSERT OR IGNORE INTO broadcast_variants (run_id, variant)
+            SELECT DISTINCT ?, subscription FROM users
+            WHERE id > ? AND subscription IS NOT NULL AND {where}
+        ''', (run_id, after_user) + params)
+        await db.execute(f'''
+            INSERT OR IGNORE INTO outbox (run_id, chat_id)
+            SELECT ?, chat_id FROM channels WHERE {where} ORDER BY id
+        ''', (run_id,) + params)
+        await db.execute('''
+            UPDATE broadcast_runs
+            SET total = (SELECT COUNT(*) FROM outbox WHERE run_id = ?),
+                user_watermark = (SELECT COALESCE(MAX(id), 0) FROM users)
+            WHERE id = ?
+        ''', (run_id, run_id))
+
+    async def get_user_currencies(self, user_id: int) -> List[str]:
+        """Currencies the user subscribed to, empty if they follow the admin's list"""
+        async with self._read() as db:
+            rows = await db.execute_fetchall(
+                'SELECT code FROM subscriptions WHERE user_id = ? ORDER BY position', (user_id,)
+            )
+            return [row[0] for row in rows]
+
+    async def set_user_currencies(self, user_id: int, codes: Sequence[str]) -> bool:
+        """Replace the user's subscription; an empty list falls back to the admin's list"""
+        codes = list(dict.fromkeys(codes))
+        try:
+            async with self._write() as db:
+                await db.execute('DELETE FROM subscriptions WHERE user_id = ?', (user_id,))
+                await db.executemany(
+                    'INSERT INTO subscriptions (user_id, code, position) VALUES (?, ?, ?)',
+                    [(user_id, code, position) for position, code in enumerate(codes)]
+                )
+                cursor = await db.execute(
+                    'UPDATE users SET subscription = ? WHERE user_id = ?',
+                    (subscription_key(codes), user_id)
+                )
+                return cursor.rowcount > 0
+        except Exception as e:
+            print(f"Error setting user currencies: {e}")
+            return False
+
+    async def set_user_send_minute(self, user_id: int, minute: Optional[int]) -> bool:
+        """Personal delivery minute of the day; None follows the global send_time"""
+        try:
+            async with self._write() as db:
+                cursor = await db.execute(
+                    'UPDATE users SET send_minute = ? WHERE user_id = ?', (minute, user_id)
+                )
+                return cursor.rowcount > 0
+        except Exception as e:
+            print(f"Error setting user send time: {e}")
+            return False
+
+    async def set_channel_send_minute(self, chat_id: str, minute: Optional[int]) -> bool:
+        """Delivery minute of the day for one channel; None follows the global send_time"""
+        try:
+            async with self._write() as db:
+                cursor = await db.execute(
+                    'UPDATE channels SET send_minute = ? WHERE chat_id = ?', (minute, chat_id)
+                )
+                return cursor.rowcount > 0
+        except Exception as e:
+            print(f"Error setting channel send time: {e}")
             return False
 
+    async def get_channel_send_minutes(self) -> Dict[str, Optional[int]]:
+        """Delivery minute per configured channel"""
+        async with self._read() as db:
+            rows = await db.execute_fetchall('SELECT chat_id, send_minute FROM channels ORDER BY id')
+            return {row[0]: row[1] for row in rows}
+
+    async def get_delivery_buckets(self) -> Dict[int, int]:
+        """Recipients per occupied custom delivery minute"""
+        async with self._read() as db:
+            rows = await db.execute_fetchall(
+                'SELECT minute, recipients FROM delivery_buckets WHERE recipients > 0 ORDER BY minute'
+            )
+            return {row[0]: row[1] for row in rows}
+
+    async def get_broadcast_run(self, run_id: int) -> Optional[Dict[str, Any]]:
+        """Get one broadcast run"""
+        async with self._read() as db:
+            rows = await db.execute_fetchall('SELECT * FROM broadcast_runs WHERE id = ?', (run_id,))
+            return dict(rows[0]) if rows else None
+
+    async def get_pending_deliveries(self, run_id: int, after_id: int = 0,
+                                     limit: int = BROADCAST_BATCH_SIZE) -> List[Tuple[int, Any, Optional[str]]]:
+        """Next batch of (outbox id, chat_id, variant) still waiting to be sent"""
+        async with self._read() as db:
+            rows = await db.execute_fetchall('''
+                SELECT id, chat_id, variant FROM outbox
+                WHERE run_id = ? AND status = 'pending' AND id > ?
+                ORDER BY id LIMIT ?
+            ''', (run_id, after_id, limit))
+            return [(row[0], row[1], row[2]) for row in rows]
+
+    async def get_broadcast_variants(self, run_id: int) -> Dict[str, Optional[str]]:
+        """Subscription key -> rendered text (None until rendered) for one run"""
+        async with self._read() as db:
+            rows = await db.execute_fetchall(
+                'SELECT variant, text FROM broadcast_variants WHERE run_id = ?', (run_id,)
+            )
+            return {row[0]: row[1] for row in rows}
+
+    async def set_broadcast_variants(self, run_id: int, texts: Dict[str, str]):
+        """Store the rendered digest of each subscription key"""
+        if not texts:
+            return
+        async with self._write() as db:
+            await db.executemany('''
+                UPDATE broadcast_variants SET text = ? WHERE run_id = ? AND variant = ?
+            ''', [(text, run_id, variant) for variant, text in texts.items()])
+
+    async def mark_deliveries(self, results: Sequence[Tuple[str, Optional[str], int]]):
+        """Record (status, error, outbox id) results; rows already finished are left untouched"""
+        if not results:
+            return
+        async with self._write() as db:
+            await db.executemany('''
+                UPDATE outbox
+                SET status = ?, last_error = ?, attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'pending'
+            ''', results)
+
+    async def finish_broadcast_run(self, run_id: int, status: str = 'done'):
+        """Mark a broadcast run as finished"""
+        async with self._write() as db:
+            await db.execute('''
+                UPDATE broadcast_runs SET status = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?
+            ''', (status, run_id))
+
+    async def get_unfinished_broadcast_runs(self, max_age_hours: float) -> List[int]:
+        """Runs interrupted by a restart; older ones are expired instead of resumed"""
+        async with self._write() as db:
+            # Prepared runs belong to the warm-up of a process that has since stopped
+            await db.execute('''
+                UPDATE broadcast_runs SET status = 'expired', finished_at = CURRENT_TIMESTAMP
+                WHERE (status = 'running' AND created_at < datetime('now', ?)) OR status = 'prepared'
+            ''', (f'-{max_age_hours} hours',))
+            rows = await db.execute_fetchall('''
+                SELECT id FROM broadcast_runs WHERE status = 'running' ORDER BY id
+            ''')
+            return [row[0] for row in rows]
+
+    async def purge_broadcast_runs(self, max_age_hours: float) -> int:
+        """Delete runs finished more than max_age_hours ago with their outbox rows and variants"""
+        async with self._write() as db:
+            # outbox and broadcast_variants rows go with the run (ON DELETE CASCADE)
+            cursor = await db.execute('''
+                DELETE FROM broadcast_runs
+                WHERE status NOT IN ('running', 'prepared') AND finished_at < datetime('now', ?)
+            ''', (f'-{max_age_hours} hours',))
+            return cursor.rowcount
+
+    async def get_broadcast_progress(self, run_id: int) -> Dict[str, int]:
+        """Recipient counts per delivery status for one run"""
+        async with self._read() as db:
+            rows = await db.execute_fetchall('''
+                SELECT status, COUNT(*) FROM outbox WHERE run_id = ? GROUP BY status
+            ''', (run_id,))
+            return {row[0]: row[1] for row in rows}
+
+    async def save_rates(self, date: str, currencies: List[Dict[str, Any]]) -> int:
+        """Store a full CBU payload for one date in a single transaction"""
+        rows = [
+            (
+                date,
+                curr['Ccy'],
+                curr.get('Rate', '0'),
+                curr.get('Diff', '0'),
+                int(curr.get('Nominal') or 1),
+                curr.get('Code'),
+                curr.get('CcyNm_EN'),
+                curr.get('CcyNm_UZ'),
+                curr.get('CcyNm_RU'),
+                curr.get('Date'),
+                position
+            )
+            for position, curr in enumerate(currencies) if curr.get('Ccy')
+        ]
+        if not rows:
+            return 0
+
+        try:
+            async with self._write() as db:
+                await db.executemany('''
+                    INSERT OR REPLACE INTO rates
+                        (date, currency, rate, diff, nominal, code, name_en, name_uz, name_ru, published,
+                         position)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+            return len(rows)
+        except Exception as e:
+            print(f"Error saving rates for {date}: {e}")
+            return 0
+
+    @staticmethod
+    def _rate_to_currency(row) -> Dict[str, Any]:
+        """Convert a rates row back to the CBU payload shape"""
+        return {
+            'Code': row['code'],
+            'Ccy': row['currency'],
+            'CcyNm_EN': row['name_en'],
+            'CcyNm_UZ': row['name_uz'],
+            'CcyNm_RU': row['name_ru'],
+            'Nominal': str(row['nominal']),
+            'Rate': row['rate'],
+            'Diff': row['diff'],
+            'Date': row['published']
+        }
+
+    async def get_rates(self, date: str) -> List[Dict[str, Any]]:
+        """Get all stored rates for one date in CBU payload shape and order"""
+        async with self._read() as db:
+            # Rows saved before positions were stored fall back to currency order
+            rows = await db.execute_fetchall('''
+                SELECT * FROM rates WHERE date = ?
+                ORDER BY position IS NULL, position, currency
+            ''', (date,))
+            return [self._rate_to_currency(row) for row in rows]
+
+    async def get_rate_history(self, currency: str, start: str, end: str) -> List[Dict[str, Any]]:
+        """Get stored rates for one currency between two dates (inclusive)"""
+        async with self._read() as db:
+            rows = await db.execute_fetchall('''
+                SELECT * FROM rates
+                WHERE currency = ? AND date BETWEEN ? AND ?
+                ORDER BY date
+            ''', (currency, start, end))
+            return [dict(self._rate_to_currency(row), date=row['date']) for row in rows]
+
+    async def get_latest_rate_date(self, before: str) -> Optional[str]:
+        """Newest stored date strictly before the given one"""
+        async with self._read() as db:
+            rows = await db.execute_fetchall('SELECT MAX(date) FROM rates WHERE date < ?', (before,))
+            return rows[0][0] if rows else None
+
+    async def get_rate_dates(self, start: str, end: str) -> List[str]:
+        """Get dates that already have stored rates"""
+        async with self._read() as db:
+            rows = await db.execute_fetchall('''
+                SELECT DISTINCT date FROM rates WHERE date BETWEEN ? AND ?
+            ''', (start, end))
+            return [row[0] for row in rows]
+
 # Global database instance
-db = Database()
\ No newline at end of file
+db = Database()
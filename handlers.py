@@ -1,82 +1,64 @@
+import asyncio
 import csv
 import io
+import tempfile
 from datetime import datetime
-from telegram import Update, ReplyKeyboardRemove
+from telegram import Update, ReplyKeyboardRemove, InlineQueryResultArticle, InputTextMessageContent
 from telegram.ext import ContextTypes, ConversationHandler
 from telegram.constants import ParseMode
 
-from database import db
+from database import db, parse_send_minute, format_send_minute
 from currency_api import currency_api
 from keyboards import keyboards
-from config import ADMIN_IDS
-
-# Currency to country flag mapping
-CURRENCY_FLAGS = {
-    'USD': '🇺🇸', 'EUR': '🇪🇺', 'GBP': '🇬🇧', 'JPY': '🇯🇵', 'CHF': '🇨🇭',
-    'CAD': '🇨🇦', 'AUD': '🇦🇺', 'NZD': '🇳🇿', 'SEK': '🇸🇪', 'NOK': '🇳🇴',
-    'DKK': '🇩🇰', 'PLN': '🇵🇱', 'CZK': '🇨🇿', 'HUF': '🇭🇺', 'RUB': '🇷🇺',
-    'CNY': '🇨🇳', 'KRW': '🇰🇷', 'SGD': '🇸🇬', 'HKD': '🇭🇰', 'INR': '🇮🇳',
-    'BRL': '🇧🇷', 'MXN': '🇲🇽', 'ZAR': '🇿🇦', 'TRY': '🇹🇷', 'AED': '🇦🇪',
-    'SAR': '🇸🇦', 'QAR': '🇶🇦', 'KWD': '🇰🇼', 'BHD': '🇧🇭', 'OMR': '🇴🇲',
-    'JOD': '🇯🇴', 'LBP': '🇱🇧', 'EGP': '🇪🇬', 'MAD': '🇲🇦', 'TND': '🇹🇳',
-    'DZD': '🇩🇿', 'LYD': '🇱🇾', 'SDG': '🇸🇩', 'ETB': '🇪🇹', 'KES': '🇰🇪',
-    'UGX': '🇺🇬', 'TZS': '🇹🇿', 'ZMW': '🇿🇲', 'BWP': '🇧🇼', 'SZL': '🇸🇿',
-    'LSL': '🇱🇸', 'NAD': '🇳🇦', 'MZN': '🇲🇿', 'AOA': '🇦🇴', 'XOF': '🇸🇳',
-    'XAF': '🇨🇲', 'CDF': '🇨🇩', 'RWF': '🇷🇼', 'BIF': '🇧🇮', 'KMF': '🇰🇲',
-    'DJF': '🇩🇯', 'SOS': '🇸🇴', 'ERN': '🇪🇷', 'ETB': '🇪🇹', 'STN': '🇸🇹',
-    'CVE': '🇨🇻', 'GMD': '🇬🇲', 'GNF': '🇬🇳', 'LRD': '🇱🇷', 'SLL': '🇸🇱',
-    'GHS': '🇬🇭', 'NGN': '🇳🇬', 'XPF': '🇵🇫', 'TOP': '🇹🇴', 'WST': '🇼🇸',
-    'VUV': '🇻🇺', 'SBD': '🇸🇧', 'PGK': '🇵🇬', 'FJD': '🇫🇯', 'NPR': '🇳🇵',
-    'PKR': '🇵🇰', 'LKR': '🇱🇰', 'BDT': '🇧🇩', 'MMK': '🇲🇲', 'THB': '🇹🇭',
-    'LAK': '🇱🇦', 'KHR': '🇰🇭', 'VND': '🇻🇳', 'IDR': '🇮🇩', 'MYR': '🇲🇾',
-    'PHP': '🇵🇭', 'BND': '🇧🇳', 'MOP': '🇲🇴', 'TWD': '🇹🇼', 'MNT': '🇲🇳',
-    'KZT': '🇰🇿', 'UZS': '🇺🇿', 'KGS': '🇰🇬', 'TJS': '🇹🇯', 'AFN': '🇦🇫',
-    'IRR': '🇮🇷', 'IQD': '🇮🇶', 'SYP': '🇸🇾', 'LBP': '🇱🇧', 'JOD': '🇯🇴',
-    'ILS': '🇮🇱', 'PAL': '🇵🇸', 'EGP': '🇪🇬', 'LYD': '🇱🇾', 'TND': '🇹🇳',
-    'DZD': '🇩🇿', 'MAD': '🇲🇦', 'SDG': '🇸🇩', 'ETB': '🇪🇹', 'SOS': '🇸🇴',
-    'DJF': '🇩🇯', 'ERN': '🇪🇷', 'STN': '🇸🇹', 'CVE': '🇨🇻', 'GMD': '🇬🇲',
-    'GNF': '🇬🇳', 'LRD': '🇱🇷', 'SLL': '🇸🇱', 'GHS': '🇬🇭', 'NGN': '🇳🇬',
-    'XOF': '🇸🇳', 'XAF': '🇨🇲', 'CDF': '🇨🇩', 'RWF': '🇷🇼', 'BIF': '🇧🇮',
-    'KMF': '🇰🇲', 'MGA': '🇲🇬', 'SCR': '🇸🇨', 'MUR': '🇲🇺', 'MVR': '🇲🇻',
-    'NPR': '🇳🇵', 'PKR': '🇵🇰', 'LKR': '🇱🇰', 'BDT': '🇧🇩', 'MMK': '🇲🇲',
-    'THB': '🇹🇭', 'LAK': '🇱🇦', 'KHR': '🇰🇭', 'VND': '🇻🇳', 'IDR': '🇮🇩',
-    'MYR': '🇲🇾', 'PHP': '🇵🇭', 'BND': '🇧🇳', 'MOP': '🇲🇴', 'TWD': '🇹🇼',
-    'MNT': '🇲🇳', 'KZT': '🇰🇿', 'UZS': '🇺🇿', 'KGS': '🇰🇬', 'TJS': '🇹🇯',
-    'AFN': '🇦🇫', 'IRR': '🇮🇷', 'IQD': '🇮🇶', 'SYP': '🇸🇾', 'ILS': '🇮🇱',
-    'PAL': '🇵🇸', 'XPF': '🇵🇫', 'TOP': '🇹🇴', 'WST': '🇼🇸', 'VUV': '🇻🇺',
-    'SBD': '🇸🇧', 'PGK': '🇵🇬', 'FJD': '🇫🇯'
-}
-
-def format_currency_with_flag(currency_data):
-    """Format currency data with country flag"""
-    currency_code = currency_data.get('Ccy', '')
-    currency_name = currency_data.get('CcyNm_EN', 'Unknown')
-    rate = currency_data.get('Rate', '0')
-    diff = currency_data.get('Diff', '0')
-    
-    # Get country flag
-    flag = CURRENCY_FLAGS.get(currency_code, '🌍')
-    
-    # Format difference with arrow
-    if diff and diff != '0':
-        try:
-            diff_float = float(diff)
-            if diff_float > 0:
-                diff_symbol = '📈 +'
-            elif diff_float < 0:
-                diff_symbol = '📉 -'
-            else:
-                diff_symbol = '➡️'
-        except:
-            diff_symbol = '➡️'
-    else:
-        diff_symbol = '➡️'
-    
-    return f"{flag} **{currency_name}** ({currency_code})\n💰 **Kurs:** {rate} so'm {diff_symbol} {diff}\n"
+from messages import message_cache, render_currency, snapshot_date, CURRENCY_FLAGS
+from converter import parse_query, render_conversion, format_amount, ConversionFilter
+from metrics import HANDLER_SECONDS, HANDLER_ERRORS, handler_labels, instrument_methods
+from phones import export_phone
+from router import Router
+from callback_data import (
+    TOGGLE_CURRENCY, MY_TOGGLE_CURRENCY, SHOW_CURRENCY, USERS_NEXT, USERS_PREV,
+    PICKER_PAGE, MY_PICKER_PAGE, NOOP
+)
+from track_import import plan_import, read_rows, write_summary
+from config import ADMIN_IDS, USERS_PAGE_SIZE, IMPORT_MAX_FILE_SIZE, INLINE_RESULTS_LIMIT
+
+def format_broadcast_report(report):
+    """Yuborish hisobotini admin uchun matnga aylantirish"""
+    if report is None:
+        return "❌ Yuborish uchun valyuta ma'lumotlari topilmadi."
+
+    return (
+        "✅ Test xabari barcha foydalanuvchilar va kanallarga yuborildi!\n\n"
+        f"📨 Yuborildi: {report.sent}/{report.total}\n"
+        f"🚫 Bloklagan: {report.blocked}\n"
+        f"❌ Xatolik: {report.failed}\n"
+        f"⏱ Vaqt: {report.duration:.1f} s ({report.throughput:.1f} xabar/s)"
+    )
+
+def known_currency_codes():
+    """Codes of the newest cached snapshot; the flag table until the first one is loaded"""
+    snapshot = currency_api.cached_snapshot()
+    return snapshot.cross_rates() if snapshot else CURRENCY_FLAGS
+
+# Free-text conversions such as "150 USD EUR"; anything else falls through to text handlers
+conversion_filter = ConversionFilter(known_currency_codes)
+
+# Menu buttons (exact labels) and inline callbacks (exact data or prefix_ + parameter);
+# the long prefixes keep buttons in messages sent before callback_data was compacted working
+menu_routes = Router('menu')
+callback_routes = Router('callback')
+
+def route_labels(name, args):
+    """Metric labels; menu messages are labelled with the handler their button routes to"""
+    if name == 'handle_menu' and len(args) > 1:
+        return name, menu_routes.label(args[1].message.text)
+    return handler_labels(name, args)
 
 # Conversation states
-WAITING_NAME, WAITING_PHONE, WAITING_TRACK_PHONE, WAITING_TRACK_CODE, WAITING_CHANNEL = range(5)
+(WAITING_NAME, WAITING_PHONE, WAITING_TRACK_PHONE, WAITING_TRACK_CODE, WAITING_CHANNEL,
+ WAITING_SEND_TIME) = range(6)
 
+@instrument_methods(HANDLER_SECONDS, HANDLER_ERRORS, labels=route_labels)
 class BotHandlers:
     def __init__(self):
         pass
@@ -146,6 +128,7 @@ class BotHandlers:
         
         return ConversationHandler.END
 
+    @menu_routes.exact("🔍 Trek kodini tekshirish")
     async def check_track_code(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Trek kodini tekshirish"""
         user_id = update.effective_user.id
@@ -169,8 +152,7 @@ class BotHandlers:
     async def check_currency(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Valyuta kursini tekshirish - admin tomonidan belgilangan valyutalarni ko'rsatish"""
         settings = await db.get_settings()
-        selected_currencies = settings.get('selected_currencies', 'USD').split(',')
-        selected_currencies = [curr.strip() for curr in selected_currencies if curr.strip()]
+        selected_currencies = settings.selected_currencies
         
         if not selected_currencies:
             await update.message.reply_text("❌ Hozircha valyuta tanlanmagan. Admin bilan bog'laning.")
@@ -181,6 +163,7 @@ class BotHandlers:
             reply_markup=keyboards.user_currencies_keyboard(selected_currencies)
         )
 
+    @menu_routes.exact("👤 Mening profilim")
     async def my_profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Foydalanuvchi profilini ko'rsatish"""
         user_id = update.effective_user.id
@@ -190,18 +173,117 @@ class BotHandlers:
             await update.message.reply_text("❌ Iltimos, avval /start orqali ro'yxatdan o'ting")
             return
 
+        send_time = await self._describe_send_time(user.get('send_minute'))
         profile_text = f"""
 👤 **Mening profilim**
 
 📝 To'liq ism: {user['fullname']}
 📱 Telefon: {user['phone']}
 📦 Trek kod: {user.get('track_code', 'Tayinlanmagan')}
+⏰ Yuborish vaqti: {send_time}
 📅 Ro'yxatdan o'tgan sana: {user['reg_date'][:10]}
         """
         
         await update.message.reply_text(profile_text, parse_mode=ParseMode.MARKDOWN)
 
+    @menu_routes.exact("💱 Valyutalarim")
+    async def my_currencies(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Foydalanuvchi kunlik xabarda oladigan valyutalarni tanlash"""
+        user_id = update.effective_user.id
+        if not await db.get_user(user_id):
+            await update.message.reply_text("❌ Iltimos, avval /start orqali ro'yxatdan o'ting")
+            return
+
+        selected_currencies = await db.get_user_currencies(user_id)
+        context.user_data['my_selected_currencies'] = selected_currencies
+        await update.message.reply_text(
+            self._my_currencies_prompt(selected_currencies),
+            reply_markup=await self._picker_keyboard(selected_currencies, 0, prefix='my_', back='my_cancel_currencies')
+        )
+
+    @staticmethod
+    async def _picker_keyboard(selected_currencies, page, **kwargs):
+        """Sahifalangan valyuta tanlash klaviaturasi (katalog kurslar snapshotidan bir marta quriladi)"""
+        catalog = await currency_api.get_catalog()
+        currencies = catalog.available() if catalog else []
+        return keyboards.currency_selection_keyboard(currencies, selected_currencies, page=page, **kwargs)
+
+    @staticmethod
+    def _toggle_params(params):
+        """'USD_2' -> ('USD', 2); eski tugmalarda sahifa bo'lmaydi"""
+        currency_code, _, page = params.partition('_')
+        return currency_code, int(page) if page.isdigit() else 0
+
+    @staticmethod
+    def _my_currencies_prompt(selected_currencies):
+        if selected_currencies:
+            return "💱 Kunlik xabarda qaysi valyutalar bo'lsin? (bir nechta tanlash mumkin)"
+        return (
+            "💱 Kunlik xabarda qaysi valyutalar bo'lsin? (bir nechta tanlash mumkin)\n\n"
+            "Hozir admin tanlagan valyutalar yuboriladi."
+        )
+
+    async def _describe_send_time(self, minute):
+        """Shaxsiy vaqt yoki umumiy yuborish vaqti matni"""
+        if minute is not None:
+            return format_send_minute(minute)
+        settings = await db.get_settings()
+        return f"{settings.send_time} (standart)"
+
+    async def send_time_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Kunlik kurs xabari vaqtini tanlash"""
+        user = await db.get_user(update.effective_user.id)
+        if not user:
+            await update.message.reply_text("❌ Iltimos, avval /start orqali ro'yxatdan o'ting")
+            return ConversationHandler.END
+
+        current = await self._describe_send_time(user.get('send_minute'))
+        await update.message.reply_text(
+            f"⏰ Kunlik valyuta kurslari yuboriladigan vaqt: {current}\n\n"
+            "Yangi vaqtni HH:MM formatida kiriting (masalan: 08:30).\n"
+            "Umumiy vaqtga qaytish uchun \"🔄 Standart vaqt\" tugmasini bosing.",
+            reply_markup=keyboards.send_time_keyboard()
+        )
+        return WAITING_SEND_TIME
+
+    async def handle_send_time(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Shaxsiy yuborish vaqtini saqlash"""
+        text = update.message.text.strip()
+        if text == "❌ Bekor qilish":
+            await update.message.reply_text(
+                "❌ Operatsiya bekor qilindi.",
+                reply_markup=keyboards.main_menu()
+            )
+            return ConversationHandler.END
+
+        if text == "🔄 Standart vaqt":
+            minute = None
+        else:
+            minute = parse_send_minute(text)
+            if minute is None:
+                await update.message.reply_text(
+                    "❌ Noto'g'ri format. Iltimos, HH:MM formatida kiriting (masalan: 08:30)"
+                )
+                return WAITING_SEND_TIME
+
+        if await db.set_user_send_minute(update.effective_user.id, minute):
+            # A new minute may need its own delivery job, an emptied one can go
+            from scheduler import scheduler
+            await scheduler.sync_buckets()
+            current = await self._describe_send_time(minute)
+            await update.message.reply_text(
+                f"✅ Kunlik valyuta kurslari har kuni {current} da yuboriladi.",
+                reply_markup=keyboards.main_menu()
+            )
+        else:
+            await update.message.reply_text(
+                "❌ Vaqtni saqlashda xatolik.",
+                reply_markup=keyboards.main_menu()
+            )
+        return ConversationHandler.END
+
     # Admin ishlovchilari
+    @menu_routes.exact("💱 Valyuta konverteri")
     async def currency_converter(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Valyuta konverteri menyusi"""
         print(f"Currency converter called by user: {update.effective_user.id}")
@@ -213,17 +295,15 @@ class BotHandlers:
 
         try:
             settings = await db.get_settings()
-            print(f"Settings: {settings}")
-            
-            selected_currencies = settings.get('selected_currencies', 'USD').split(',')
-            selected_currencies = [curr.strip() for curr in selected_currencies if curr.strip()]
+            selected_currencies = settings.selected_currencies
             
             message = f"""💱 **Valyuta konverteri sozlamalari**
 
 💰 **Tanlangan valyutalar:** {', '.join(selected_currencies)}
-⏰ **Yuborish vaqti:** {settings.get('send_time', '09:00')}
+⏰ **Yuborish vaqti:** {settings.send_time}
 
 📝 **Yuborish vaqtini o'zgartirish uchun:** HH:MM formatida vaqt yuboring (masalan: 14:30)
+🧮 **Konvertatsiya:** summa va valyutalarni yuboring (masalan: 150 USD EUR)
 
 Quyidagi sozlamalarni tanlang:"""
 
@@ -236,26 +316,34 @@ Quyidagi sozlamalarni tanlang:"""
             print(f"Error in currency_converter: {e}")
             await update.message.reply_text(f"❌ Xatolik: {str(e)}")
 
+    @menu_routes.exact("👥 Foydalanuvchilar")
     async def users_list(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Foydalanuvchilar ro'yxatini ko'rsatish"""
         if update.effective_user.id not in ADMIN_IDS:
             await update.message.reply_text("❌ Ruxsat berilmagan.")
             return
 
-        users = await db.get_all_users()
+        users, has_next = await db.get_users_page()
         
         if not users:
             await update.message.reply_text("👥 Foydalanuvchilar topilmadi.")
             return
 
-        text = "👥 **Ro'yxatdan o'tgan foydalanuvchilar:**\n\n"
-        for i, user in enumerate(users[:20], 1):  # Show first 20 users
+        text, reply_markup = await self._users_page(1, users, False, has_next)
+        await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
+
+    async def _users_page(self, page, users, has_prev, has_next):
+        """Foydalanuvchilar sahifasi matni va tugmalari"""
+        total = await db.count_users()
+        pages = max(1, -(-total // USERS_PAGE_SIZE))
+        offset = (page - 1) * USERS_PAGE_SIZE
+
+        text = f"👥 **Ro'yxatdan o'tgan foydalanuvchilar** ({page}/{pages}, jami {total}):\n\n"
+        for i, user in enumerate(users, offset + 1):
             text += f"{i}. {user['fullname']} - {user['phone']}\n"
-        
-        if len(users) > 20:
-            text += f"\n... va yana {len(users) - 20} ta foydalanuvchi"
 
-        await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+        reply_markup = keyboards.users_page_keyboard(page, users[0]['id'], users[-1]['id'], has_prev, has_next)
+        return text, reply_markup
 
     async def track_code_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Trek kod tayinlash"""
@@ -264,7 +352,9 @@ Quyidagi sozlamalarni tanlang:"""
             return
 
         await update.message.reply_text(
-            "📦 Trek kod tayinlash uchun telefon raqamini kiriting:",
+            "📦 Trek kod tayinlash uchun telefon raqamini kiriting.\n\n"
+            "📄 Ko'p trek kodlarni birdaniga tayinlash uchun XLSX yoki CSV fayl yuboring "
+            "(ustunlar: telefon, trek kod):",
             reply_markup=keyboards.cancel_keyboard()
         )
         return WAITING_TRACK_PHONE
@@ -323,24 +413,81 @@ Quyidagi sozlamalarni tanlang:"""
         
         return ConversationHandler.END
 
+    async def handle_track_import(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Yuklangan XLSX/CSV fayldan trek kodlarni ommaviy tayinlash"""
+        document = update.message.document
+        extension = (document.file_name or '').rsplit('.', 1)[-1].lower()
+
+        if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+            await update.message.reply_text(
+                "❌ Fayl juda katta (maksimal 20 MB).",
+                reply_markup=keyboards.admin_menu()
+            )
+            return ConversationHandler.END
+
+        await update.message.reply_text("⏳ Fayl qayta ishlanmoqda...")
+
+        # Fayl diskka yuklanadi va qatorlar oqim bilan o'qiladi
+        with tempfile.TemporaryFile() as upload:
+            telegram_file = await document.get_file()
+            await telegram_file.download_to_memory(upload)
+            upload.seek(0)
+            try:
+                plan = await asyncio.to_thread(lambda: plan_import(read_rows(upload, extension)))
+            except Exception as e:
+                print(f"Error reading track code import: {e}")
+                await update.message.reply_text(
+                    "❌ Faylni o'qib bo'lmadi. XLSX yoki CSV formatidagi fayl yuboring.",
+                    reply_markup=keyboards.admin_menu()
+                )
+                return ConversationHandler.END
+
+        # Telefonlar bitta so'rovlar to'plamida tekshiriladi, yangilanishlar bitta tranzaksiyada
+        matched = await db.get_existing_phone_keys(plan.updates)
+        await db.update_track_codes([
+            (track_code, phone_key)
+            for phone_key, (_, _, track_code) in plan.updates.items() if phone_key in matched
+        ])
+
+        summary_file = tempfile.TemporaryFile(suffix='.csv')
+        counts = write_summary(plan, matched, summary_file)
+        summary_file.seek(0)
+
+        with summary_file:
+            await update.message.reply_document(
+                document=summary_file,
+                filename=f"trek_import_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                caption=(
+                    f"📦 Trek kodlar importi - {counts['total']} ta qator\n\n"
+                    f"✅ Yangilandi: {counts['updated']}\n"
+                    f"🔍 Topilmadi: {counts['unmatched']}\n"
+                    f"🔁 Takroriy: {counts['duplicates']}\n"
+                    f"⚠️ Noto'g'ri: {counts['invalid']}"
+                ),
+                reply_markup=keyboards.admin_menu()
+            )
+        return ConversationHandler.END
+
     async def channels_management(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Kanallar boshqaruvi"""
         if update.effective_user.id not in ADMIN_IDS:
             await update.message.reply_text("❌ Ruxsat berilmagan.")
             return
 
-        settings = await db.get_settings()
-        channels = settings.get('channels', '').split(',')
-        channels = [ch.strip() for ch in channels if ch.strip()]
+        channels = await db.get_channel_send_minutes()
         
         if channels:
-            channels_text = "\n".join([f"• {channel}" for channel in channels])
+            channels_text = "\n".join([
+                f"• {channel}" + (f" - ⏰ {format_send_minute(minute)}" if minute is not None else "")
+                for channel, minute in channels.items()
+            ])
             message = f"""📢 **Ulangan kanallar:**
 
 {channels_text}
 
 Yangi kanal qo'shish uchun kanal ID yoki username yuboring.
-Kanal o'chirish uchun kanal ID yoki username yuboring."""
+Kanal o'chirish uchun kanal ID yoki username yuboring.
+Kanalga alohida vaqt belgilash: @mychannel 09:00 (standart vaqtga qaytarish: @mychannel standart)"""
         else:
             message = """📢 **Ulangan kanallar yo'q**
 
@@ -363,13 +510,23 @@ Masalan: @mychannel yoki -1001234567890"""
             )
             return ConversationHandler.END
 
-        channel_input = update.message.text.strip()
+        parts = update.message.text.split()
+        if len(parts) not in (1, 2):
+            await update.message.reply_text(
+                "❌ Noto'g'ri format. Masalan: @mychannel yoki @mychannel 09:00",
+                reply_markup=keyboards.admin_menu()
+            )
+            return ConversationHandler.END
+
+        channel_input = parts[0]
         settings = await db.get_settings()
-        channels = settings.get('channels', '').split(',')
-        channels = [ch.strip() for ch in channels if ch.strip()]
+
+        # "@channel HH:MM" sets the channel's own delivery time
+        if len(parts) == 2:
+            return await self._set_channel_time(update, channel_input, parts[1], settings.channels)
         
         # Check if channel already exists
-        if channel_input in channels:
+        if channel_input in settings.channels:
             await update.message.reply_text(
                 f"❌ Kanal {channel_input} allaqachon qo'shilgan.",
                 reply_markup=keyboards.admin_menu()
@@ -377,8 +534,7 @@ Masalan: @mychannel yoki -1001234567890"""
             return ConversationHandler.END
         
         # Add new channel
-        channels.append(channel_input)
-        success = await db.update_settings(channels=','.join(channels))
+        success = await db.add_channel(channel_input)
         
         if success:
             await update.message.reply_text(
@@ -393,6 +549,41 @@ Masalan: @mychannel yoki -1001234567890"""
         
         return ConversationHandler.END
 
+    async def _set_channel_time(self, update: Update, channel, time_input, channels):
+        """Kanal uchun alohida yuborish vaqtini belgilash"""
+        if time_input.lower() == 'standart':
+            minute = None
+        else:
+            minute = parse_send_minute(time_input)
+            if minute is None:
+                await update.message.reply_text(
+                    "❌ Noto'g'ri format. Masalan: @mychannel 09:00",
+                    reply_markup=keyboards.admin_menu()
+                )
+                return ConversationHandler.END
+
+        if channel not in channels and not await db.add_channel(channel):
+            await update.message.reply_text(
+                "❌ Kanal qo'shishda xatolik.",
+                reply_markup=keyboards.admin_menu()
+            )
+            return ConversationHandler.END
+
+        if await db.set_channel_send_minute(channel, minute):
+            from scheduler import scheduler
+            await scheduler.sync_buckets()
+            current = await self._describe_send_time(minute)
+            await update.message.reply_text(
+                f"✅ Kanal {channel} uchun yuborish vaqti: {current}",
+                reply_markup=keyboards.admin_menu()
+            )
+        else:
+            await update.message.reply_text(
+                "❌ Vaqtni saqlashda xatolik.",
+                reply_markup=keyboards.admin_menu()
+            )
+        return ConversationHandler.END
+
     async def handle_text_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle text messages for custom time input"""
         print(f"Text message handler called with text: {update.message.text}")
@@ -474,9 +665,9 @@ Masalan: @mychannel yoki -1001234567890"""
         from scheduler import scheduler
         
         try:
-            await scheduler.send_currency_update()
+            report = await scheduler.send_currency_update()
             await update.message.reply_text(
-                "✅ Test xabari barcha foydalanuvchilar va kanallarga yuborildi!",
+                format_broadcast_report(report),
                 reply_markup=keyboards.admin_menu()
             )
         except Exception as e:
@@ -485,6 +676,7 @@ Masalan: @mychannel yoki -1001234567890"""
                 reply_markup=keyboards.admin_menu()
             )
 
+    @menu_routes.exact("📊 Statistika")
     async def statistics(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Bot statistikasini ko'rsatish"""
         if update.effective_user.id not in ADMIN_IDS:
@@ -492,320 +684,454 @@ Masalan: @mychannel yoki -1001234567890"""
             return
 
         stats = await db.get_user_stats()
+        daily = await db.get_daily_stats()
         settings = await db.get_settings()
-        channels = settings.get('channels', '').split(',') if settings.get('channels') else []
-        selected_currencies = settings.get('selected_currencies', 'USD').split(',')
-        selected_currencies = [curr.strip() for curr in selected_currencies if curr.strip()]
+        channels = settings.channels
+        selected_currencies = settings.selected_currencies
+
+        total = stats['total_users']
+        coverage = stats['with_track_code'] * 100 / total if total else 0
+        daily_lines = '\n'.join(
+            f"  {row['day'][5:]}: +{row['registrations']} foydalanuvchi, {row['track_codes']} trek kod"
+            for row in daily
+        )
         
         stats_text = f"""
 📊 **Bot statistikasi**
 
-👥 Jami foydalanuvchilar: {stats['total_users']}
-🟢 Faol foydalanuvchilar (30 kun): {stats['active_users']}
-📢 Ulangan kanallar: {len([ch for ch in channels if ch.strip()])}
+👥 Jami foydalanuvchilar: {total}
+🟢 Faol: {stats['active_users']} | ⚪️ Nofaol: {stats['inactive_users']}
+🆕 Yangi (1 / 7 / 30 kun): {stats['registered_1d']} / {stats['registered_7d']} / {stats['registered_30d']}
+📦 Trek kodli: {stats['with_track_code']} ({coverage:.1f}%)
+
+📅 **Kunlar bo'yicha:**
+{daily_lines}
+
+📢 Ulangan kanallar: {len(channels)}
 💱 Tanlangan valyutalar: {', '.join(selected_currencies)}
-⏰ Yuborish vaqti: {settings.get('send_time', '09:00')}
+⏰ Yuborish vaqti: {settings.send_time}
         """
         
         await update.message.reply_text(stats_text, parse_mode=ParseMode.MARKDOWN)
 
+    @menu_routes.exact("📤 Eksport")
     async def export_users(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Foydalanuvchilarni Excel formatida eksport qilish"""
         if update.effective_user.id not in ADMIN_IDS:
             await update.message.reply_text("❌ Ruxsat berilmagan.")
             return
 
-        users = await db.get_all_users()
+        summary = await db.get_export_summary()
         
-        if not users:
+        if not summary['total']:
             await update.message.reply_text("👥 Eksport qilish uchun foydalanuvchilar yo'q.")
             return
 
         try:
             import openpyxl
-            from openpyxl import Workbook
-            from openpyxl.styles import Font, Alignment, PatternFill
-            
-            # Excel workbook yaratish
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Foydalanuvchilar"
-            
-            # Sarlavhalar
-            headers = ['To\'liq ism', 'Telefon', 'Trek kod']
-            for col, header in enumerate(headers, 1):
-                cell = ws.cell(row=1, column=col, value=header)
-                cell.font = Font(bold=True, color="FFFFFF")
-                cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-                cell.alignment = Alignment(horizontal="center")
-            
-            # Ma'lumotlarni qo'shish
-            for row, user in enumerate(users, 2):
-                # Telefon raqamini to'g'ri formatda yozish
-                phone = user['phone']
-                if phone.startswith('+998'):
-                    phone = phone[1:]  # + ni olib tashlash
-                elif phone.startswith('998'):
-                    pass  # allaqachon to'g'ri
-                elif phone.startswith('8'):
-                    phone = '998' + phone[1:]  # 8 ni 998 ga almashtirish
-                elif phone.startswith('9'):
-                    phone = '998' + phone  # 9 dan boshlansa 998 qo'shish
-                
-                ws.cell(row=row, column=1, value=user['fullname'])
-                ws.cell(row=row, column=2, value=phone)
-                ws.cell(row=row, column=3, value=user.get('track_code', ''))
-            
-            # Ustunlarni kengaytirish
-            for column in ws.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                ws.column_dimensions[column_letter].width = adjusted_width
-            
-            # Excel faylini saqlash
-            excel_buffer = io.BytesIO()
-            wb.save(excel_buffer)
-            excel_buffer.seek(0)
-            
-            filename = f"foydalanuvchilar_eksport_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-            
-            await update.message.reply_document(
-                document=excel_buffer,
-                filename=filename,
-                caption=f"📤 Foydalanuvchilar eksporti - {len(users)} ta foydalanuvchi"
-            )
-            
+            export_file = await self._export_xlsx(summary)
+            extension = 'xlsx'
         except ImportError:
             # openpyxl yo'q bo'lsa, CSV formatida yuborish
             await update.message.reply_text("❌ Excel formatida eksport qilish uchun openpyxl kutubxonasi kerak. Avval CSV formatida yuborilmoqda...")
-            
-            # CSV yaratish
-            output = io.StringIO()
-            writer = csv.writer(output)
-            writer.writerow(['To\'liq ism', 'Telefon', 'Trek kod'])
-            
-            for user in users:
-                # Telefon raqamini to'g'ri formatda yozish
-                phone = user['phone']
-                if phone.startswith('+998'):
-                    phone = phone[1:]
-                elif phone.startswith('998'):
-                    pass
-                elif phone.startswith('8'):
-                    phone = '998' + phone[1:]
-                elif phone.startswith('9'):
-                    phone = '998' + phone
-                
-                writer.writerow([
-                    user['fullname'],
-                    phone,
-                    user.get('track_code', '')
-                ])
-            
-            csv_data = output.getvalue().encode('utf-8')
-            filename = f"foydalanuvchilar_eksport_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            
+            export_file = await self._export_csv()
+            extension = 'csv'
+
+        filename = f"foydalanuvchilar_eksport_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+        
+        # Vaqtinchalik fayl yuborilgandan keyin o'chiriladi
+        with export_file:
             await update.message.reply_document(
-                document=io.BytesIO(csv_data),
+                document=export_file,
                 filename=filename,
-                caption=f"📤 Foydalanuvchilar eksporti - {len(users)} ta foydalanuvchi"
+                caption=f"📤 Foydalanuvchilar eksporti - {summary['total']} ta foydalanuvchi"
             )
 
+    @staticmethod
+    def _export_row(user):
+        """Eksport qatori: ism, telefon, trek kod"""
+        return [user['fullname'], export_phone(user['phone_key'] or user['phone']), user.get('track_code')]
+
+    async def _export_xlsx(self, summary):
+        """Foydalanuvchilarni bo'laklab write-only Excel faylga yozish"""
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font, Alignment, PatternFill
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Foydalanuvchilar")
+
+        # Ustun kengliklari oldindan hisoblanadi (write-only rejimda birinchi qatordan oldin kerak)
+        headers = ['To\'liq ism', 'Telefon', 'Trek kod']
+        lengths = [summary['fullname'], summary['phone'], summary['track_code']]
+        for letter, header, length in zip('ABC', headers, lengths):
+            ws.column_dimensions[letter].width = min(max(length, len(header)) + 2, 50)
+
+        # Sarlavhalar
+        header_cells = []
+        for header in headers:
+            cell = WriteOnlyCell(ws, value=header)
+            cell.font = Font(bold=True, color="FFFFFF")
+            cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+            cell.alignment = Alignment(horizontal="center")
+            header_cells.append(cell)
+        ws.append(header_cells)
+
+        def write_chunk(users):
+            for user in users:
+                ws.append(self._export_row(user))
+
+        # Ma'lumotlarni qo'shish - har bir bo'lak alohida oqimda yoziladi
+        async for users in db.iter_users():
+            await asyncio.to_thread(write_chunk, users)
+
+        export_file = tempfile.TemporaryFile(suffix='.xlsx')
+        await asyncio.to_thread(wb.save, export_file)
+        export_file.seek(0)
+        return export_file
+
+    async def _export_csv(self):
+        """Foydalanuvchilarni bo'laklab CSV faylga yozish"""
+        export_file = tempfile.TemporaryFile(suffix='.csv')
+        output = io.TextIOWrapper(export_file, encoding='utf-8', newline='')
+        writer = csv.writer(output)
+        writer.writerow(['To\'liq ism', 'Telefon', 'Trek kod'])
+
+        async for users in db.iter_users():
+            writer.writerows(self._export_row(user) for user in users)
+
+        output.flush()
+        output.detach()
+        export_file.seek(0)
+        return export_file
+
+    async def handle_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Menyu tugmalarini jadval orqali yo'naltirish"""
+        await menu_routes.dispatch(self, update.message.text, update, context)
+
+    async def handle_conversion(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """"150 USD EUR" ko'rinishidagi so'rovni kurslar matritsasi orqali hisoblash"""
+        amount, source, target = parse_query(update.message.text)
+        snapshot = await currency_api.get_snapshot()
+        if snapshot is None:
+            await update.message.reply_text("❌ Valyuta ma'lumotlari topilmadi.")
+            return
+
+        conversion = snapshot.cross_rates().convert(amount, source, target)
+        if conversion is None:
+            unknown = [code for code in (source, target) if code not in snapshot.cross_rates()]
+            await update.message.reply_text(
+                f"❌ Noma'lum valyuta: {', '.join(unknown)}. Masalan: 150 USD EUR"
+            )
+            return
+
+        today = datetime.now().strftime('%Y-%m-%d')
+        stale_date = snapshot_date(snapshot) if snapshot.is_stale_for(today) else None
+        await update.message.reply_text(
+            render_conversion(conversion, stale_date), parse_mode=ParseMode.MARKDOWN
+        )
+
+    def _inline_conversion(self, query):
+        """Inline so'rov konvertatsiya bo'lsa, uning natijasi"""
+        parsed = parse_query(query)
+        snapshot = currency_api.cached_snapshot()
+        if parsed is None or snapshot is None:
+            return None
+        conversion = snapshot.cross_rates().convert(*parsed)
+        if conversion is None:
+            return None
+
+        today = datetime.now().strftime('%Y-%m-%d')
+        stale_date = snapshot_date(snapshot) if snapshot.is_stale_for(today) else None
+        return InlineQueryResultArticle(
+            id=f"convert_{conversion.source}_{conversion.target}",
+            title=(
+                f"{format_amount(conversion.amount)} {conversion.source} = "
+                f"{format_amount(conversion.result)} {conversion.target}"
+            ),
+            description=f"1 {conversion.source} = {format_amount(conversion.rate)} {conversion.target}",
+            input_message_content=InputTextMessageContent(
+                render_conversion(conversion, stale_date), parse_mode=ParseMode.MARKDOWN
+            )
+        )
+
+    async def handle_inline_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Valyutalarni qidirish yoki "150 usd eur" konvertatsiyasi (faqat xotiradagi ma'lumotdan)"""
+        inline_query = update.inline_query
+        conversion = self._inline_conversion(inline_query.query)
+        if conversion is not None:
+            await inline_query.answer([conversion], cache_time=60)
+            return
+
+        catalog = currency_api.cached_catalog()
+        if catalog is None:
+            await inline_query.answer([], cache_time=5)
+            return
+
+        stale = catalog.date != datetime.now().strftime('%Y-%m-%d')
+        results = [
+            InlineQueryResultArticle(
+                id=entry.code,
+                title=f"{entry.code} - {entry.name_en}",
+                description=f"{entry.name_uz} · {entry.name_ru} · {entry.data.get('Rate', '0')} so'm",
+                input_message_content=InputTextMessageContent(
+                    render_currency(entry.data, stale), parse_mode=ParseMode.MARKDOWN
+                )
+            )
+            for entry in catalog.search(inline_query.query, INLINE_RESULTS_LIMIT)
+        ]
+        await inline_query.answer(results, cache_time=60)
+
     # Callback ishlovchilari
     async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Callback so'rovlarini boshqarish"""
+        """Callback so'rovlarini jadval orqali yo'naltirish"""
         query = update.callback_query
         await query.answer()
+
+        if not await callback_routes.dispatch(self, query.data, update, context):
+            print(f"Unrouted callback data: {query.data}")
+
+    @callback_routes.exact("currency_converter", "back_admin")
+    async def converter_settings(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        settings = await db.get_settings()
+        selected_currencies = settings.selected_currencies
         
-        data = query.data
-        
-        if data == "currency_converter":
-            settings = await db.get_settings()
-            selected_currencies = settings.get('selected_currencies', 'USD').split(',')
-            selected_currencies = [curr.strip() for curr in selected_currencies if curr.strip()]
-            
-            message = f"""💱 **Valyuta konverteri sozlamalari**
+        message = f"""💱 **Valyuta konverteri sozlamalari**
 
 💰 **Tanlangan valyutalar:** {', '.join(selected_currencies)}
-⏰ **Yuborish vaqti:** {settings.get('send_time', '09:00')}
+⏰ **Yuborish vaqti:** {settings.send_time}
 
 📝 **Yuborish vaqtini o'zgartirish uchun:** HH:MM formatida vaqt yuboring (masalan: 14:30)
+🧮 **Konvertatsiya:** summa va valyutalarni yuboring (masalan: 150 USD EUR)
 
 Quyidagi sozlamalarni tanlang:"""
-            
-            await query.edit_message_text(
-                message,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=keyboards.currency_converter_menu()
-            )
         
-        elif data == "choose_currency":
-            currencies = await currency_api.get_available_currencies()
+        await update.callback_query.edit_message_text(
+            message,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=keyboards.currency_converter_menu()
+        )
+
+    @callback_routes.exact("choose_currency")
+    async def choose_currency(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        settings = await db.get_settings()
+        selected_currencies = list(settings.selected_currencies)
+        # Toggles on every page edit this copy until it is saved
+        context.user_data['temp_selected_currencies'] = selected_currencies
+        
+        await update.callback_query.edit_message_text(
+            "💰 Valyutalarni tanlang (bir nechta tanlash mumkin):",
+            reply_markup=await self._picker_keyboard(selected_currencies, 0)
+        )
+
+    async def _admin_selection(self, context):
+        selected_currencies = context.user_data.get('temp_selected_currencies')
+        if selected_currencies is None:
             settings = await db.get_settings()
-            selected_currencies = settings.get('selected_currencies', 'USD').split(',')
-            selected_currencies = [curr.strip() for curr in selected_currencies if curr.strip()]
-            
+            selected_currencies = context.user_data['temp_selected_currencies'] = list(settings.selected_currencies)
+        return selected_currencies
+
+    @callback_routes.prefix(TOGGLE_CURRENCY, "toggle_currency_")
+    async def toggle_currency(self, update: Update, context: ContextTypes.DEFAULT_TYPE, params: str):
+        currency_code, page = self._toggle_params(params)
+        selected_currencies = await self._admin_selection(context)
+        
+        if currency_code in selected_currencies:
+            selected_currencies.remove(currency_code)
+        else:
+            selected_currencies.append(currency_code)
+        
+        await update.callback_query.edit_message_text(
+            "💰 Valyutalarni tanlang (bir nechta tanlash mumkin):",
+            reply_markup=await self._picker_keyboard(selected_currencies, page)
+        )
+
+    @callback_routes.prefix(PICKER_PAGE)
+    async def picker_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE, page: str):
+        selected_currencies = await self._admin_selection(context)
+        await update.callback_query.edit_message_text(
+            "💰 Valyutalarni tanlang (bir nechta tanlash mumkin):",
+            reply_markup=await self._picker_keyboard(selected_currencies, int(page))
+        )
+
+    @callback_routes.exact(NOOP)
+    async def noop(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Sahifa raqami tugmasi hech narsa qilmaydi"""
+
+    @callback_routes.exact("save_currencies")
+    async def save_currencies(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        selected_currencies = context.user_data.pop('temp_selected_currencies', ['USD'])
+        if not selected_currencies:
+            selected_currencies = ['USD']
+        
+        if await db.update_settings(selected_currencies=selected_currencies):
+            # Digests of the old selection would only take up cache slots
+            message_cache.invalidate()
+        await update.callback_query.edit_message_text(
+            f"✅ Valyutalar saqlandi: {', '.join(selected_currencies)}",
+            reply_markup=keyboards.back_to_admin()
+        )
+
+    @callback_routes.exact("test_send")
+    async def test_send(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        # Execute test send immediately
+        try:
+            from scheduler import scheduler
+            report = await scheduler.send_currency_update()
             await query.edit_message_text(
-                "💰 Valyutalarni tanlang (bir nechta tanlash mumkin):",
-                reply_markup=keyboards.currency_selection_keyboard(currencies, selected_currencies)
+                format_broadcast_report(report),
+                reply_markup=keyboards.back_to_admin()
             )
-        
-        elif data.startswith("toggle_currency_"):
-            currency_code = data.replace("toggle_currency_", "")
-            settings = await db.get_settings()
-            selected_currencies = settings.get('selected_currencies', 'USD').split(',')
-            selected_currencies = [curr.strip() for curr in selected_currencies if curr.strip()]
-            
-            if currency_code in selected_currencies:
-                selected_currencies.remove(currency_code)
+        except Exception as e:
+            await query.edit_message_text(
+                f"❌ Test yuborishda xatolik: {str(e)}",
+                reply_markup=keyboards.back_to_admin()
+            )
+
+    @callback_routes.exact("check_schedule")
+    async def check_schedule(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        # Check current schedule status
+        try:
+            from scheduler import scheduler
+            jobs = scheduler.scheduler.get_jobs()
+            job_info = []
+            for job in jobs:
+                if job.id == 'currency_update':
+                    job_info.append(f"⏰ Currency Update: {job.next_run_time}")
+                elif job.id == 'currency_warmup':
+                    job_info.append(f"🔥 Warm-up: {job.next_run_time}")
+                elif job.id.startswith('delivery_'):
+                    job_info.append(f"👥 Shaxsiy vaqt {format_send_minute(job.args[0])}: {job.next_run_time}")
+
+            if job_info:
+                message = "📅 **Joriy rejasi:**\n" + "\n".join(job_info)
             else:
-                selected_currencies.append(currency_code)
+                message = "❌ Hech qanday reja topilmadi"
             
-            # Update context for current selection
-            context.user_data['temp_selected_currencies'] = selected_currencies
-            
-            currencies = await currency_api.get_available_currencies()
             await query.edit_message_text(
-                "💰 Valyutalarni tanlang (bir nechta tanlash mumkin):",
-                reply_markup=keyboards.currency_selection_keyboard(currencies, selected_currencies)
+                message,
+                reply_markup=keyboards.back_to_admin()
             )
-        
-        elif data == "save_currencies":
-            selected_currencies = context.user_data.get('temp_selected_currencies', ['USD'])
-            if not selected_currencies:
-                selected_currencies = ['USD']
-            
-            await db.update_settings(selected_currencies=','.join(selected_currencies))
+        except Exception as e:
             await query.edit_message_text(
-                f"✅ Valyutalar saqlandi: {', '.join(selected_currencies)}",
+                f"❌ Rejani tekshirishda xatolik: {str(e)}",
                 reply_markup=keyboards.back_to_admin()
             )
+
+    @callback_routes.prefix(USERS_NEXT, "users_next_")
+    async def users_next(self, update: Update, context: ContextTypes.DEFAULT_TYPE, params: str):
+        await self._turn_users_page(update.callback_query, params, backwards=False)
+
+    @callback_routes.prefix(USERS_PREV, "users_prev_")
+    async def users_prev(self, update: Update, context: ContextTypes.DEFAULT_TYPE, params: str):
+        await self._turn_users_page(update.callback_query, params, backwards=True)
+
+    async def _turn_users_page(self, query, params, backwards):
+        if query.from_user.id not in ADMIN_IDS:
+            await query.edit_message_text("❌ Ruxsat berilmagan.")
+            return
+
+        page, anchor_id = map(int, params.split("_")[:2])
+        users, has_more = await db.get_users_page(anchor_id, backwards=backwards)
         
+        if not users:
+            await query.edit_message_text("👥 Foydalanuvchilar topilmadi.")
+            return
         
-        elif data == "test_send":
-            # Execute test send immediately
-            try:
-                from scheduler import scheduler
-                await scheduler.send_currency_update()
-                await query.edit_message_text(
-                    "✅ Test xabari barcha foydalanuvchilar va kanallarga yuborildi!",
-                    reply_markup=keyboards.back_to_admin()
-                )
-            except Exception as e:
-                await query.edit_message_text(
-                    f"❌ Test yuborishda xatolik: {str(e)}",
-                    reply_markup=keyboards.back_to_admin()
-                )
-        
-        elif data == "check_schedule":
-            # Check current schedule status
-            try:
-                from scheduler import scheduler
-                jobs = scheduler.scheduler.get_jobs()
-                job_info = []
-                for job in jobs:
-                    if job.id == 'currency_update':
-                        job_info.append(f"⏰ Currency Update: {job.next_run_time}")
-                
-                if job_info:
-                    message = "📅 **Joriy rejasi:**\n" + "\n".join(job_info)
-                else:
-                    message = "❌ Hech qanday reja topilmadi"
-                
-                await query.edit_message_text(
-                    message,
-                    reply_markup=keyboards.back_to_admin()
-                )
-            except Exception as e:
-                await query.edit_message_text(
-                    f"❌ Rejani tekshirishda xatolik: {str(e)}",
-                    reply_markup=keyboards.back_to_admin()
-                )
-        
-        
+        if backwards:
+            has_prev, has_next = has_more, True
+        else:
+            has_prev, has_next = True, has_more
         
-        elif data == "back_admin":
-            settings = await db.get_settings()
-            selected_currencies = settings.get('selected_currencies', 'USD').split(',')
-            selected_currencies = [curr.strip() for curr in selected_currencies if curr.strip()]
-            
-            message = f"""💱 **Valyuta konverteri sozlamalari**
+        text, reply_markup = await self._users_page(page, users, has_prev and page > 1, has_next)
+        await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=reply_markup)
 
-💰 **Tanlangan valyutalar:** {', '.join(selected_currencies)}
-⏰ **Yuborish vaqti:** {settings.get('send_time', '09:00')}
+    @callback_routes.prefix(MY_TOGGLE_CURRENCY, "my_toggle_currency_")
+    async def my_toggle_currency(self, update: Update, context: ContextTypes.DEFAULT_TYPE, params: str):
+        currency_code, page = self._toggle_params(params)
+        selected_currencies = list(context.user_data.get('my_selected_currencies', []))
 
-📝 **Yuborish vaqtini o'zgartirish uchun:** HH:MM formatida vaqt yuboring (masalan: 14:30)
+        if currency_code in selected_currencies:
+            selected_currencies.remove(currency_code)
+        else:
+            selected_currencies.append(currency_code)
+        context.user_data['my_selected_currencies'] = selected_currencies
 
-Quyidagi sozlamalarni tanlang:"""
-            
-            await query.edit_message_text(
-                message,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=keyboards.currency_converter_menu()
-            )
-        
-        elif data == "back_main":
-            await query.edit_message_text(
-                "👋 Asosiy menyuga qaytildi",
-                reply_markup=keyboards.main_menu()
+        await update.callback_query.edit_message_text(
+            self._my_currencies_prompt(selected_currencies),
+            reply_markup=await self._picker_keyboard(
+                selected_currencies, page, prefix='my_', back='my_cancel_currencies'
             )
-        
-        elif data.startswith("show_currency_"):
-            currency_code = data.replace("show_currency_", "")
-            currency_data = await currency_api.get_currency_by_code(currency_code)
-            
-            if currency_data:
-                # Format currency with flag and trend
-                currency_info = format_currency_with_flag(currency_data)
-                message = f"""{currency_info}
+        )
 
-📅 **Sana:** {currency_data.get('Date', 'Noma\'lum')}
+    @callback_routes.prefix(MY_PICKER_PAGE)
+    async def my_picker_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE, page: str):
+        selected_currencies = context.user_data.get('my_selected_currencies', [])
+        await update.callback_query.edit_message_text(
+            self._my_currencies_prompt(selected_currencies),
+            reply_markup=await self._picker_keyboard(
+                selected_currencies, int(page), prefix='my_', back='my_cancel_currencies'
+            )
+        )
 
-📊 O'zbekiston Respublikasi Markaziy Banki"""
-                await query.edit_message_text(message, parse_mode=ParseMode.MARKDOWN)
+    @callback_routes.exact("my_save_currencies")
+    async def my_save_currencies(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        selected_currencies = context.user_data.pop('my_selected_currencies', [])
+        if await db.set_user_currencies(query.from_user.id, selected_currencies):
+            if selected_currencies:
+                message = f"✅ Valyutalaringiz saqlandi: {', '.join(selected_currencies)}"
             else:
-                await query.edit_message_text("❌ Valyuta ma'lumotlari topilmadi.")
+                message = "✅ Endi admin tanlagan valyutalar yuboriladi."
+        else:
+            message = "❌ Valyutalarni saqlashda xatolik."
+        await query.edit_message_text(message)
+
+    @callback_routes.exact("my_cancel_currencies")
+    async def my_cancel_currencies(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        context.user_data.pop('my_selected_currencies', None)
+        await update.callback_query.edit_message_text("❌ Operatsiya bekor qilindi.")
+
+    @callback_routes.exact("back_main")
+    async def back_main(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await update.callback_query.edit_message_text(
+            "👋 Asosiy menyuga qaytildi",
+            reply_markup=keyboards.main_menu()
+        )
+
+    @callback_routes.prefix(SHOW_CURRENCY, "show_currency_", "select_currency_")
+    async def show_currency(self, update: Update, context: ContextTypes.DEFAULT_TYPE, currency_code: str):
+        query = update.callback_query
+        message = await message_cache.currency(currency_code)
         
-        elif data == "show_all_currencies":
-            # Show all selected currencies in one message
-            settings = await db.get_settings()
-            selected_currencies = settings.get('selected_currencies', 'USD').split(',')
-            selected_currencies = [curr.strip() for curr in selected_currencies if curr.strip()]
-            
-            if not selected_currencies:
-                await query.edit_message_text("❌ Hozircha valyuta tanlanmagan.")
-                return
-            
-            # Collect all currency data
-            currency_messages = []
-            for currency_code in selected_currencies:
-                currency_data = await currency_api.get_currency_by_code(currency_code)
-                
-                if currency_data:
-                    currency_info = format_currency_with_flag(currency_data)
-                    currency_messages.append(currency_info)
-            
-            if not currency_messages:
-                await query.edit_message_text("❌ Valyuta ma'lumotlari topilmadi.")
-                return
-            
-            # Combine all currencies into one message
-            message = f"""📊 **Valyuta kurslari**
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-{''.join(currency_messages)}
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-📅 **Sana:** {datetime.now().strftime('%d.%m.%Y')}
-📊 **O'zbekiston Respublikasi Markaziy Banki**"""
-            
+        if message:
             await query.edit_message_text(message, parse_mode=ParseMode.MARKDOWN)
+        else:
+            await query.edit_message_text("❌ Valyuta ma'lumotlari topilmadi.")
+
+    @callback_routes.exact("show_all_currencies")
+    async def show_all_currencies(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        # Show the user's own currencies, or the admin's list
+        selected_currencies = await db.get_user_currencies(query.from_user.id)
+        if not selected_currencies:
+            settings = await db.get_settings()
+            selected_currencies = settings.selected_currencies
+        
+        if not selected_currencies:
+            await query.edit_message_text("❌ Hozircha valyuta tanlanmagan.")
+            return
+        
+        # Bir xil kurslar va tanlov uchun matn faqat bir marta yig'iladi
+        message = await message_cache.digest(selected_currencies)
+        
+        if not message:
+            await query.edit_message_text("❌ Valyuta ma'lumotlari topilmadi.")
+            return
+        
+        await query.edit_message_text(message, parse_mode=ParseMode.MARKDOWN)
 
 # Global handlers instance
 handlers = BotHandlers()
\ No newline at end of file
@@ -1,17 +1,81 @@
+from functools import lru_cache
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
-from typing import List, Dict, Any
+from typing import List, Dict, Tuple
+
+from callback_data import TOGGLE_CURRENCY, SHOW_CURRENCY, USERS_NEXT, USERS_PREV, PICKER_PAGE, NOOP, pack
+from config import CATALOG_PAGE_SIZE
+
+class SelectionLayout:
+    """Checkbox buttons of one currency list, built once in both states.
+
+    Telegram objects are immutable, so a render only picks the checked or unchecked
+    button per currency of the requested page instead of formatting every label and
+    callback again. Toggle data carries the currency's page so the redraw stays on it.
+    """
+
+    def __init__(self, currencies: List[Dict[str, str]], prefix: str, back: str,
+                 page_size: int = CATALOG_PAGE_SIZE):
+        self.source = currencies
+        self.prefix = prefix
+        self.rows_per_page = max(1, page_size // 2)
+        self.rows: List[List[Tuple[str, InlineKeyboardButton, InlineKeyboardButton]]] = []
+        for i in range(0, len(currencies), 2):
+            page = i // (self.rows_per_page * 2)
+            row = []
+            for curr in currencies[i:i + 2]:
+                label = f"{curr['code']} - {curr['name'][:15]}..."
+                data = pack(prefix + TOGGLE_CURRENCY, curr['code'], page)
+                row.append((
+                    curr['code'],
+                    InlineKeyboardButton(f"☑️ {label}", callback_data=data),
+                    InlineKeyboardButton(f"☐ {label}", callback_data=data),
+                ))
+            self.rows.append(row)
+        self.pages = max(1, -(-len(self.rows) // self.rows_per_page))
+        self.footer = [
+            [InlineKeyboardButton("🔍 Qidirish", switch_inline_query_current_chat="")],
+            [InlineKeyboardButton("✅ Saqlash", callback_data=f"{prefix}save_currencies")],
+            [InlineKeyboardButton("🔙 Orqaga", callback_data=back)],
+        ]
+
+    def render(self, selected_currencies, page: int = 0) -> InlineKeyboardMarkup:
+        selected = set(selected_currencies)
+        page = min(max(page, 0), self.pages - 1)
+        start = page * self.rows_per_page
+        keyboard = [
+            [checked if code in selected else unchecked for code, checked, unchecked in row]
+            for row in self.rows[start:start + self.rows_per_page]
+        ]
+        if self.pages > 1:
+            navigation = []
+            if page > 0:
+                navigation.append(InlineKeyboardButton(
+                    "⬅️", callback_data=pack(self.prefix + PICKER_PAGE, page - 1)))
+            navigation.append(InlineKeyboardButton(f"{page + 1}/{self.pages}", callback_data=NOOP))
+            if page < self.pages - 1:
+                navigation.append(InlineKeyboardButton(
+                    "➡️", callback_data=pack(self.prefix + PICKER_PAGE, page + 1)))
+            keyboard.append(navigation)
+        return InlineKeyboardMarkup(keyboard + self.footer)
 
 class Keyboards:
+    def __init__(self):
+        # (prefix, back) -> layout of the last currency list seen
+        self._selection_layouts: Dict[Tuple[str, str], SelectionLayout] = {}
+
+    # Static menus are immutable Telegram objects, so each is built once and reused
     @staticmethod
+    @lru_cache(maxsize=None)
     def main_menu() -> ReplyKeyboardMarkup:
         """Oddiy foydalanuvchilar uchun asosiy menyu"""
         keyboard = [
-            [KeyboardButton("🔍 Trek kodini tekshirish")],
-            [KeyboardButton("👤 Mening profilim")]
+            [KeyboardButton("🔍 Trek kodini tekshirish"), KeyboardButton("💱 Valyutalarim")],
+            [KeyboardButton("👤 Mening profilim"), KeyboardButton("⏰ Yuborish vaqti")]
         ]
         return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def admin_menu() -> ReplyKeyboardMarkup:
         """Admin menyusi"""
         keyboard = [
@@ -22,6 +86,7 @@ class Keyboards:
         return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def currency_converter_menu() -> InlineKeyboardMarkup:
         """Valyuta konverteri pastki menyusi"""
         keyboard = [
@@ -43,7 +108,7 @@ class Keyboards:
                     curr = currencies[i + j]
                     row.append(InlineKeyboardButton(
                         f"{curr['code']} - {curr['name'][:15]}...",
-                        callback_data=f"select_currency_{curr['code']}"
+                        callback_data=pack(SHOW_CURRENCY, curr['code'])
                     ))
             keyboard.append(row)
         
@@ -51,24 +116,38 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def phone_request() -> ReplyKeyboardMarkup:
         """Telefon raqamini so'rash klaviaturasi"""
         keyboard = [[KeyboardButton("📱 Telefon raqamini ulashish", request_contact=True)]]
         return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def cancel_keyboard() -> ReplyKeyboardMarkup:
         """Operatsiyani bekor qilish klaviaturasi"""
         keyboard = [[KeyboardButton("❌ Bekor qilish")]]
         return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
     @staticmethod
+    @lru_cache(maxsize=None)
+    def send_time_keyboard() -> ReplyKeyboardMarkup:
+        """Shaxsiy yuborish vaqtini tanlash klaviaturasi"""
+        keyboard = [
+            [KeyboardButton("🔄 Standart vaqt")],
+            [KeyboardButton("❌ Bekor qilish")]
+        ]
+        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
     def back_to_admin() -> InlineKeyboardMarkup:
         """Admin menyusiga qaytish tugmasi"""
         keyboard = [[InlineKeyboardButton("🔙 Admin menyusiga qaytish", callback_data="back_admin")]]
         return InlineKeyboardMarkup(keyboard)
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def confirm_keyboard() -> InlineKeyboardMarkup:
         """Tasdiqlash klaviaturasi"""
         keyboard = [
@@ -77,32 +156,23 @@ class Keyboards:
         ]
         return InlineKeyboardMarkup(keyboard)
 
-    @staticmethod
-    def currency_selection_keyboard(currencies: List[Dict[str, str]], selected_currencies: List[str] = None) -> InlineKeyboardMarkup:
-        """Valyuta tanlash klaviaturasi (checkbox'lar bilan)"""
-        if selected_currencies is None:
-            selected_currencies = []
-        
-        keyboard = []
-        for i in range(0, len(currencies), 2):
-            row = []
-            for j in range(2):
-                if i + j < len(currencies):
-                    curr = currencies[i + j]
-                    is_selected = curr['code'] in selected_currencies
-                    checkbox = "☑️" if is_selected else "☐"
-                    row.append(InlineKeyboardButton(
-                        f"{checkbox} {curr['code']} - {curr['name'][:15]}...",
-                        callback_data=f"toggle_currency_{curr['code']}"
-                    ))
-            keyboard.append(row)
-        
-        keyboard.append([InlineKeyboardButton("✅ Saqlash", callback_data="save_currencies")])
-        keyboard.append([InlineKeyboardButton("🔙 Orqaga", callback_data="currency_converter")])
-        return InlineKeyboardMarkup(keyboard)
+    def currency_selection_keyboard(self, currencies: List[Dict[str, str]], selected_currencies: List[str] = None,
+                                    prefix: str = '', back: str = 'currency_converter',
+                                    page: int = 0) -> InlineKeyboardMarkup:
+        """Valyuta tanlash klaviaturasi (checkbox'lar bilan, sahifalab).
+
+        prefix ajratadi: admin ro'yxati ('') yoki foydalanuvchi obunasi ('my_').
+        Tugmalar ro'yxat (kurslar snapshoti) o'zgarmaguncha qayta yaratilmaydi.
+        """
+        key = (prefix, back)
+        layout = self._selection_layouts.get(key)
+        if layout is None or layout.source is not currencies:
+            layout = self._selection_layouts[key] = SelectionLayout(currencies, prefix, back)
+        return layout.render(selected_currencies or (), page)
 
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def test_send_keyboard() -> InlineKeyboardMarkup:
         """Test yuborish klaviaturasi"""
         keyboard = [
@@ -112,6 +182,16 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
 
 
+    @staticmethod
+    def users_page_keyboard(page: int, first_id: int, last_id: int, has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
+        """Foydalanuvchilar ro'yxati sahifalash tugmalari"""
+        row = []
+        if has_prev:
+            row.append(InlineKeyboardButton("⬅️ Oldingi", callback_data=pack(USERS_PREV, page - 1, first_id)))
+        if has_next:
+            row.append(InlineKeyboardButton("Keyingi ➡️", callback_data=pack(USERS_NEXT, page + 1, last_id)))
+        return InlineKeyboardMarkup([row] if row else [])
+
     @staticmethod
     def user_currencies_keyboard(selected_currencies: List[str]) -> InlineKeyboardMarkup:
         """Foydalanuvchilar uchun valyuta klaviaturasi"""
@@ -127,7 +207,7 @@ class Keyboards:
                     curr_code = selected_currencies[i + j]
                     row.append(InlineKeyboardButton(
                         curr_code,
-                        callback_data=f"show_currency_{curr_code}"
+                        callback_data=pack(SHOW_CURRENCY, curr_code)
                     ))
             keyboard.append(row)
         
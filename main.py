@@ -1,11 +1,18 @@
 import asyncio
 import logging
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ConversationHandler, filters
+from telegram.ext import (
+    Application, CommandHandler, MessageHandler, CallbackQueryHandler, ConversationHandler, InlineQueryHandler, filters
+)
 
-from config import BOT_TOKEN, ADMIN_IDS
+from config import BOT_TOKEN, ADMIN_IDS, RUN_MODE, ALLOWED_UPDATES, WEBHOOK_QUEUE_SIZE, METRICS_ENABLED
 from database import db
-from handlers import handlers, WAITING_NAME, WAITING_PHONE, WAITING_TRACK_PHONE, WAITING_TRACK_CODE, WAITING_CHANNEL
+from currency_api import currency_api
+from handlers import (
+    handlers, menu_routes, conversion_filter, WAITING_NAME, WAITING_PHONE, WAITING_TRACK_PHONE, WAITING_TRACK_CODE,
+    WAITING_CHANNEL, WAITING_SEND_TIME
+)
 from scheduler import scheduler
+from metrics import metrics_server
 
 # Enable logging
 logging.basicConfig(
@@ -21,7 +28,11 @@ async def error_handler(update, context):
 def main():
     """Main function to run the bot"""
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    builder = Application.builder().token(BOT_TOKEN)
+    if RUN_MODE == 'webhook':
+        # Updates arrive over HTTP; a bounded queue lets the server push back when busy
+        builder = builder.updater(None).update_queue(asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE))
+    application = builder.build()
 
     # Registration conversation handler
     registration_conv = ConversationHandler(
@@ -40,7 +51,13 @@ def main():
     track_code_conv = ConversationHandler(
         entry_points=[MessageHandler(filters.Regex('^📦 Trek kod$'), handlers.track_code_menu)],
         states={
-            WAITING_TRACK_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_track_phone)],
+            WAITING_TRACK_PHONE: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_track_phone),
+                MessageHandler(
+                    filters.Document.FileExtension('xlsx') | filters.Document.FileExtension('csv'),
+                    handlers.handle_track_import
+                ),
+            ],
             WAITING_TRACK_CODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_track_code)],
         },
         fallbacks=[MessageHandler(filters.Regex('^❌ Bekor qilish$'), handlers.start)],
@@ -55,31 +72,38 @@ def main():
         fallbacks=[MessageHandler(filters.Regex('^❌ Bekor qilish$'), handlers.start)],
     )
 
-
+    # Personal delivery time conversation handler
+    send_time_conv = ConversationHandler(
+        entry_points=[MessageHandler(filters.Regex('^⏰ Yuborish vaqti$'), handlers.send_time_menu)],
+        states={
+            WAITING_SEND_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_send_time)],
+        },
+        fallbacks=[MessageHandler(filters.Regex('^❌ Bekor qilish$'), handlers.start)],
+    )
 
     # Add handlers
     application.add_handler(registration_conv)
     application.add_handler(track_code_conv)
     application.add_handler(channels_conv)
+    application.add_handler(send_time_conv)
     
     # Command handlers
     application.add_handler(CommandHandler('start', handlers.start))
     
-    # Message handlers for menu buttons
-    application.add_handler(MessageHandler(filters.Regex('^🔍 Trek kodini tekshirish$'), handlers.check_track_code))
-    application.add_handler(MessageHandler(filters.Regex('^👤 Mening profilim$'), handlers.my_profile))
+    # Menu buttons: one set lookup routed through handlers.menu_routes
+    application.add_handler(MessageHandler(menu_routes.filter(), handlers.handle_menu))
     
-    # Admin handlers
-    application.add_handler(MessageHandler(filters.Regex('^💱 Valyuta konverteri$'), handlers.currency_converter))
-    application.add_handler(MessageHandler(filters.Regex('^👥 Foydalanuvchilar$'), handlers.users_list))
-    application.add_handler(MessageHandler(filters.Regex('^📊 Statistika$'), handlers.statistics))
-    application.add_handler(MessageHandler(filters.Regex('^📤 Eksport$'), handlers.export_users))
+    # Free-text conversions such as "150 USD EUR"
+    application.add_handler(MessageHandler(filters.TEXT & conversion_filter, handlers.handle_conversion))
     
     # Text message handler (must be last to avoid conflicts)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_text_message))
     
     # Callback query handler
     application.add_handler(CallbackQueryHandler(handlers.handle_callback))
+
+    # Inline currency search (@bot eur)
+    application.add_handler(InlineQueryHandler(handlers.handle_inline_query))
     
     # Error handler
     application.add_error_handler(error_handler)
@@ -87,16 +111,35 @@ def main():
     # Initialize database and scheduler
     async def post_init(application):
         await db.init_db()
+        await currency_api.open()
         await scheduler.update_schedule()
         scheduler.start()
+        await scheduler.resume_broadcasts()
+        if METRICS_ENABLED:
+            # Metrics are optional; a busy port must not stop the bot
+            try:
+                await metrics_server.start()
+            except OSError as e:
+                print(f"Metrics server not started: {e}")
         print("Bot muvaffaqiyatli ishga tushirildi!")
 
+    # Close HTTP session and database connections on shutdown
+    async def post_shutdown(application):
+        await metrics_server.stop()
+        await currency_api.close()
+        await db.close()
+
     # Set post init
     application.post_init = post_init
+    application.post_shutdown = post_shutdown
 
     # Run the bot
-    print("Bot ishga tushirilmoqda...")
-    application.run_polling(allowed_updates=['message', 'callback_query'])
+    print(f"Bot ishga tushirilmoqda ({RUN_MODE})...")
+    if RUN_MODE == 'webhook':
+        from webhook import run_webhook
+        run_webhook(application)
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,194 @@
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Sequence, Tuple
+
+from currency_api import currency_api, RateSnapshot
+from config import MESSAGE_CACHE_SIZE
+
+# Bump when the digest layout below changes so cached texts are rebuilt
+DIGEST_TEMPLATE_VERSION = 1
+
+DIGEST_SEPARATOR = "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+
+# Shown when today's rates could not be fetched and an older snapshot is served
+STALE_NOTICE = "⚠️ Bugungi kurslar hali olinmadi, {date} holatidagi kurslar ko'rsatilmoqda."
+
+# Digest titles per use: the scheduled post and the on-demand view
+DIGEST_TITLES = {
+    'broadcast': "📊 **Valyuta kurslari yangilanishi**",
+    'view': "📊 **Valyuta kurslari**",
+}
+
+# Currency to country flag mapping
+CURRENCY_FLAGS = {
+    'USD': '🇺🇸', 'EUR': '🇪🇺', 'GBP': '🇬🇧', 'JPY': '🇯🇵', 'CHF': '🇨🇭',
+    'CAD': '🇨🇦', 'AUD': '🇦🇺', 'NZD': '🇳🇿', 'SEK': '🇸🇪', 'NOK': '🇳🇴',
+    'DKK': '🇩🇰', 'PLN': '🇵🇱', 'CZK': '🇨🇿', 'HUF': '🇭🇺', 'RUB': '🇷🇺',
+    'CNY': '🇨🇳', 'KRW': '🇰🇷', 'SGD': '🇸🇬', 'HKD': '🇭🇰', 'INR': '🇮🇳',
+    'BRL': '🇧🇷', 'MXN': '🇲🇽', 'ZAR': '🇿🇦', 'TRY': '🇹🇷', 'AED': '🇦🇪',
+    'SAR': '🇸🇦', 'QAR': '🇶🇦', 'KWD': '🇰🇼', 'BHD': '🇧🇭', 'OMR': '🇴🇲',
+    'JOD': '🇯🇴', 'LBP': '🇱🇧', 'EGP': '🇪🇬', 'MAD': '🇲🇦', 'TND': '🇹🇳',
+    'DZD': '🇩🇿', 'LYD': '🇱🇾', 'SDG': '🇸🇩', 'ETB': '🇪🇹', 'KES': '🇰🇪',
+    'UGX': '🇺🇬', 'TZS': '🇹🇿', 'ZMW': '🇿🇲', 'BWP': '🇧🇼', 'SZL': '🇸🇿',
+    'LSL': '🇱🇸', 'NAD': '🇳🇦', 'MZN': '🇲🇿', 'AOA': '🇦🇴', 'XOF': '🇸🇳',
+    'XAF': '🇨🇲', 'CDF': '🇨🇩', 'RWF': '🇷🇼', 'BIF': '🇧🇮', 'KMF': '🇰🇲',
+    'DJF': '🇩🇯', 'SOS': '🇸🇴', 'ERN': '🇪🇷', 'ETB': '🇪🇹', 'STN': '🇸🇹',
+    'CVE': '🇨🇻', 'GMD': '🇬🇲', 'GNF': '🇬🇳', 'LRD': '🇱🇷', 'SLL': '🇸🇱',
+    'GHS': '🇬🇭', 'NGN': '🇳🇬', 'XPF': '🇵🇫', 'TOP': '🇹🇴', 'WST': '🇼🇸',
+    'VUV': '🇻🇺', 'SBD': '🇸🇧', 'PGK': '🇵🇬', 'FJD': '🇫🇯', 'NPR': '🇳🇵',
+    'PKR': '🇵🇰', 'LKR': '🇱🇰', 'BDT': '🇧🇩', 'MMK': '🇲🇲', 'THB': '🇹🇭',
+    'LAK': '🇱🇦', 'KHR': '🇰🇭', 'VND': '🇻🇳', 'IDR': '🇮🇩', 'MYR': '🇲🇾',
+    'PHP': '🇵🇭', 'BND': '🇧🇳', 'MOP': '🇲🇴', 'TWD': '🇹🇼', 'MNT': '🇲🇳',
+    'KZT': '🇰🇿', 'UZS': '🇺🇿', 'KGS': '🇰🇬', 'TJS': '🇹🇯', 'AFN': '🇦🇫',
+    'IRR': '🇮🇷', 'IQD': '🇮🇶', 'SYP': '🇸🇾', 'LBP': '🇱🇧', 'JOD': '🇯🇴',
+    'ILS': '🇮🇱', 'PAL': '🇵🇸', 'EGP': '🇪🇬', 'LYD': '🇱🇾', 'TND': '🇹🇳',
+    'DZD': '🇩🇿', 'MAD': '🇲🇦', 'SDG': '🇸🇩', 'ETB': '🇪🇹', 'SOS': '🇸🇴',
+    'DJF': '🇩🇯', 'ERN': '🇪🇷', 'STN': '🇸🇹', 'CVE': '🇨🇻', 'GMD': '🇬🇲',
+    'GNF': '🇬🇳', 'LRD': '🇱🇷', 'SLL': '🇸🇱', 'GHS': '🇬🇭', 'NGN': '🇳🇬',
+    'XOF': '🇸🇳', 'XAF': '🇨🇲', 'CDF': '🇨🇩', 'RWF': '🇷🇼', 'BIF': '🇧🇮',
+    'KMF': '🇰🇲', 'MGA': '🇲🇬', 'SCR': '🇸🇨', 'MUR': '🇲🇺', 'MVR': '🇲🇻',
+    'NPR': '🇳🇵', 'PKR': '🇵🇰', 'LKR': '🇱🇰', 'BDT': '🇧🇩', 'MMK': '🇲🇲',
+    'THB': '🇹🇭', 'LAK': '🇱🇦', 'KHR': '🇰🇭', 'VND': '🇻🇳', 'IDR': '🇮🇩',
+    'MYR': '🇲🇾', 'PHP': '🇵🇭', 'BND': '🇧🇳', 'MOP': '🇲🇴', 'TWD': '🇹🇼',
+    'MNT': '🇲🇳', 'KZT': '🇰🇿', 'UZS': '🇺🇿', 'KGS': '🇰🇬', 'TJS': '🇹🇯',
+    'AFN': '🇦🇫', 'IRR': '🇮🇷', 'IQD': '🇮🇶', 'SYP': '🇸🇾', 'ILS': '🇮🇱',
+    'PAL': '🇵🇸', 'XPF': '🇵🇫', 'TOP': '🇹🇴', 'WST': '🇼🇸', 'VUV': '🇻🇺',
+    'SBD': '🇸🇧', 'PGK': '🇵🇬', 'FJD': '🇫🇯'
+}
+
+def format_currency_with_flag(currency_data):
+    """Format currency data with country flag"""
+    currency_code = currency_data.get('Ccy', '')
+    currency_name = currency_data.get('CcyNm_EN', 'Unknown')
+    rate = currency_data.get('Rate', '0')
+    diff = currency_data.get('Diff', '0')
+    
+    # Get country flag
+    flag = CURRENCY_FLAGS.get(currency_code, '🌍')
+    
+    # Format difference with arrow
+    if diff and diff != '0':
+        try:
+            diff_float = float(diff)
+            if diff_float > 0:
+                diff_symbol = '📈 +'
+            elif diff_float < 0:
+                diff_symbol = '📉 -'
+            else:
+                diff_symbol = '➡️'
+        except:
+            diff_symbol = '➡️'
+    else:
+        diff_symbol = '➡️'
+    
+    return f"{flag} **{currency_name}** ({currency_code})\n💰 **Kurs:** {rate} so'm {diff_symbol} {diff}\n"
+
+def snapshot_date(snapshot: RateSnapshot) -> str:
+    """Snapshot date as DD.MM.YYYY for message footers"""
+    try:
+        return datetime.strptime(snapshot.date, '%Y-%m-%d').strftime('%d.%m.%Y')
+    except ValueError:
+        return snapshot.date
+
+def render_digest(snapshot: RateSnapshot, codes: Sequence[str], kind: str = 'view',
+                  stale: bool = False) -> Optional[str]:
+    """All selected currencies in one Markdown message"""
+    currency_messages = []
+    for currency_code in codes:
+        currency_data = snapshot.by_code.get(currency_code)
+        if not currency_data:
+            print(f"Failed to fetch currency data for {currency_code}")
+            continue
+        currency_messages.append(format_currency_with_flag(currency_data))
+
+    if not currency_messages:
+        return None
+
+    title = DIGEST_TITLES[kind]
+    if stale:
+        title += "\n" + STALE_NOTICE.format(date=snapshot_date(snapshot))
+
+    return f"""{title}
+{DIGEST_SEPARATOR}
+
+{''.join(currency_messages)}
+{DIGEST_SEPARATOR}
+📅 **Sana:** {snapshot_date(snapshot)}
+📊 **O'zbekiston Respublikasi Markaziy Banki**"""
+
+def render_currency(currency_data: Dict[str, str], stale: bool = False) -> str:
+    """One currency with flag, trend and date"""
+    currency_info = format_currency_with_flag(currency_data)
+    rate_date = currency_data.get('Date', "Noma'lum")
+    if stale:
+        currency_info = STALE_NOTICE.format(date=rate_date) + "\n\n" + currency_info
+    return f"""{currency_info}
+
+📅 **Sana:** {rate_date}
+
+📊 O'zbekiston Respublikasi Markaziy Banki"""
+
+class MessageCache:
+    """Rendered rate messages keyed by (kind, rate date, snapshot, currency set, template version).
+
+    A new snapshot gets a new serial, so texts built from older rates are never
+    served again and simply age out of the LRU.
+    """
+
+    def __init__(self, max_size: int = MESSAGE_CACHE_SIZE):
+        self.max_size = max_size
+        self._messages: "OrderedDict[Tuple, Optional[str]]" = OrderedDict()
+
+    def _get(self, key: Tuple):
+        if key in self._messages:
+            self._messages.move_to_end(key)
+            return True, self._messages[key]
+        return False, None
+
+    def _put(self, key: Tuple, text: Optional[str]):
+        self._messages[key] = text
+        while len(self._messages) > self.max_size:
+            self._messages.popitem(last=False)
+
+    def invalidate(self):
+        """Forget every rendered message"""
+        self._messages.clear()
+
+    async def digest(self, codes: Sequence[str], kind: str = 'view', date: str = None,
+                     wait: bool = False) -> Optional[str]:
+        """Digest for the selected currencies, rendered once per snapshot.
+
+        wait=True blocks on the network for the requested date instead of serving
+        an older snapshot straight away.
+        """
+        date = date or datetime.now().strftime('%Y-%m-%d')
+        snapshot = await currency_api.get_snapshot(date, wait=wait)
+        if snapshot is None:
+            return None
+
+        stale = snapshot.is_stale_for(date)
+        key = ('digest', kind, snapshot.date, snapshot.serial, tuple(codes), stale, DIGEST_TEMPLATE_VERSION)
+        found, text = self._get(key)
+        if not found:
+            text = render_digest(snapshot, codes, kind, stale)
+            self._put(key, text)
+        return text
+
+    async def currency(self, code: str, date: str = None) -> Optional[str]:
+        """Single currency message, rendered once per snapshot"""
+        date = date or datetime.now().strftime('%Y-%m-%d')
+        snapshot = await currency_api.get_snapshot(date)
+        if snapshot is None:
+            return None
+
+        stale = snapshot.is_stale_for(date)
+        key = ('currency', snapshot.date, snapshot.serial, code, stale, DIGEST_TEMPLATE_VERSION)
+        found, text = self._get(key)
+        if not found:
+            currency_data = snapshot.by_code.get(code)
+            text = render_currency(currency_data, stale) if currency_data else None
+            self._put(key, text)
+        return text
+
+# Global message cache shared by the scheduler and handlers
+message_cache = MessageCache()
@@ -0,0 +1,234 @@
+import functools
+import inspect
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+from aiohttp import web
+
+from config import METRICS_LISTEN, METRICS_PORT
+
+# Seconds; covers sub-millisecond DB reads up to slow broadcasts
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Base for metrics kept in plain dicts keyed by label values.
+
+    The bot runs on one event loop, so updates need no locking.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    """Monotonic count per label set"""
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in sorted(self._values.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+    kind = 'gauge'
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+class Histogram(Metric):
+    """Cumulative bucket counts plus sum and count per label set"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def count(self, *labels: str) -> int:
+        entry = self._values.get(labels)
+        return sum(entry[0]) if entry else 0
+
+    def total(self, *labels: str) -> float:
+        entry = self._values.get(labels)
+        return entry[1] if entry else 0.0
+
+    def samples(self) -> Iterable[str]:
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}'
+            label_text = _format_labels(self.labelnames, labels)
+            yield f'{self.name}_sum{label_text} {_format_value(total)}'
+            yield f'{self.name}_count{label_text} {cumulative}'
+
+class Registry:
+    """Named collection of metrics rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+# Global registry and the bot's metrics
+registry = Registry()
+
+HANDLER_SECONDS = registry.histogram(
+    'bot_handler_seconds', 'Time spent in update handlers', ('handler', 'callback'))
+HANDLER_ERRORS = registry.counter(
+    'bot_handler_errors_total', 'Exceptions raised by update handlers', ('handler', 'error'))
+DB_SECONDS = registry.histogram(
+    'bot_db_seconds', 'Time spent in Database methods', ('method',))
+DB_ERRORS = registry.counter(
+    'bot_db_errors_total', 'Exceptions raised by Database methods', ('method', 'error'))
+CBU_FETCH_SECONDS = registry.histogram(
+    'bot_cbu_fetch_seconds', 'CBU rate requests by outcome', ('status',))
+TELEGRAM_SEND_SECONDS = registry.histogram(
+    'bot_telegram_send_seconds', 'Latency of send_message calls during broadcasts')
+BROADCAST_MESSAGES = registry.counter(
+    'bot_broadcast_messages_total', 'Broadcast deliveries by final status', ('status',))
+BROADCAST_ERRORS = registry.counter(
+    'bot_broadcast_errors_total', 'Errors seen while broadcasting, including retried ones', ('error',))
+BROADCAST_RUNS = registry.counter(
+    'bot_broadcast_runs_total', 'Finished broadcast runs')
+BROADCAST_THROUGHPUT = registry.gauge(
+    'bot_broadcast_last_throughput', 'Messages per second of the last finished broadcast run')
+
+LabelFunction = Callable[[str, tuple], LabelValues]
+
+def instrument_methods(histogram: Histogram, errors: Optional[Counter] = None,
+                       labels: Optional[LabelFunction] = None, exclude: Sequence[str] = ()):
+    """Class decorator timing every public coroutine method into histogram.
+
+    labels(name, args) gives the label values (default: just the method name);
+    exceptions are counted in errors by class name and re-raised.
+    """
+    def decorate(cls):
+        for name, method in list(vars(cls).items()):
+            if name.startswith('_') or name in exclude or not inspect.iscoroutinefunction(method):
+                continue
+            setattr(cls, name, _timed(method, name, histogram, errors, labels))
+        return cls
+    return decorate
+
+def _timed(method, name: str, histogram: Histogram, errors: Optional[Counter],
+           labels: Optional[LabelFunction]):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        label_values = labels(name, args) if labels else (name,)
+        try:
+            return await method(*args, **kwargs)
+        except Exception as e:
+            if errors is not None:
+                errors.inc(label_values[0], type(e).__name__)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started, *label_values)
+    return wrapper
+
+def callback_route(data: Optional[str]) -> str:
+    """Callback data without its numeric parts, e.g. users_next_2_15 -> users_next"""
+    if not data:
+        return ''
+    return '_'.join(part for part in data.split('_') if not part.lstrip('-').isdigit())
+
+def handler_labels(name: str, args: tuple) -> LabelValues:
+    """(handler, callback route) for BotHandlers methods called as (self, update, context)"""
+    update = args[1] if len(args) > 1 else None
+    query = getattr(update, 'callback_query', None)
+    return name, callback_route(query.data) if query is not None else ''
+
+class MetricsServer:
+    """Serve the registry on /metrics for a local Prometheus scraper"""
+
+    def __init__(self, listen: str = METRICS_LISTEN, port: int = METRICS_PORT,
+                 source: Registry = registry):
+        self.listen = listen
+        self.port = port
+        self.registry = source
+        self._runner: Optional[web.AppRunner] = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=self.registry.render().encode('utf-8'),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+        )
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        print(f"Metrics available at http://{self.listen}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+# Global metrics server instance
+metrics_server = MetricsServer()
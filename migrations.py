@@ -0,0 +1,353 @@
+import aiosqlite
+from typing import Awaitable, Callable, List, Tuple
+from config import DEFAULT_CURRENCY, DEFAULT_SEND_TIME, DEFAULT_TEMPLATE
+from phones import normalize_phone
+
+# Rows updated per statement when backfilling new columns
+BACKFILL_BATCH_SIZE = 1000
+
+# Each migration runs once; the applied version is kept in PRAGMA user_version
+Migration = Callable[[aiosqlite.Connection], Awaitable[None]]
+
+async def base_schema(db: aiosqlite.Connection):
+    """Users, settings and rates tables"""
+    # Users table
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER UNIQUE NOT NULL,
+            fullname TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            track_code TEXT,
+            reg_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT 1
+        )
+    ''')
+
+    # Settings table
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            id INTEGER PRIMARY KEY,
+            currency TEXT DEFAULT 'USD',
+            selected_currencies TEXT DEFAULT 'USD',
+            send_time TEXT DEFAULT '09:00',
+            template TEXT DEFAULT '',
+            channels TEXT DEFAULT ''
+        )
+    ''')
+
+    # Historical CBU rates, one row per currency per day
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS rates (
+            date TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            rate TEXT NOT NULL,
+            diff TEXT DEFAULT '0',
+            nominal INTEGER DEFAULT 1,
+            code TEXT,
+            name_en TEXT,
+            name_uz TEXT,
+            name_ru TEXT,
+            published TEXT,
+            PRIMARY KEY (date, currency)
+        ) WITHOUT ROWID
+    ''')
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_rates_currency_date ON rates (currency, date)
+    ''')
+
+    # Insert default settings if not exists
+    await db.execute('''
+        INSERT OR IGNORE INTO settings (id, currency, selected_currencies, send_time, template, channels)
+        VALUES (1, ?, ?, ?, ?, '')
+    ''', (DEFAULT_CURRENCY, DEFAULT_CURRENCY, DEFAULT_SEND_TIME, DEFAULT_TEMPLATE))
+
+async def user_indexes(db: aiosqlite.Connection):
+    """Indexes for phone lookups, date ordering and active filters"""
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_users_phone ON users (phone)')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_users_reg_date ON users (reg_date)')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_users_is_active ON users (is_active)')
+
+def _split(value) -> List[str]:
+    if not value:
+        return []
+    items = []
+    for item in value.split(','):
+        item = item.strip()
+        if item and item not in items:
+            items.append(item)
+    return items
+
+async def settings_lists(db: aiosqlite.Connection):
+    """Move comma-joined channels and selected currencies into their own tables"""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS channels (
+            id INTEGER PRIMARY KEY,
+            chat_id TEXT UNIQUE NOT NULL,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS selected_currencies (
+            code TEXT PRIMARY KEY,
+            position INTEGER NOT NULL
+        )
+    ''')
+
+    async with db.execute('SELECT selected_currencies, channels FROM settings WHERE id = 1') as cursor:
+        row = await cursor.fetchone()
+    if row is None:
+        return
+
+    await db.executemany(
+        'INSERT OR IGNORE INTO channels (chat_id) VALUES (?)',
+        [(channel,) for channel in _split(row[1])]
+    )
+    await db.executemany(
+        'INSERT OR IGNORE INTO selected_currencies (code, position) VALUES (?, ?)',
+        [(code, position) for position, code in enumerate(_split(row[0]))]
+    )
+
+async def phone_keys(db: aiosqlite.Connection):
+    """Canonical phone key column, backfilled in batches and indexed"""
+    columns = [row[1] for row in await db.execute_fetchall('PRAGMA table_info(users)')]
+    if 'phone_key' not in columns:
+        await db.execute("ALTER TABLE users ADD COLUMN phone_key TEXT NOT NULL DEFAULT ''")
+
+    last_id = 0
+    while True:
+        rows = await db.execute_fetchall('''
+            SELECT id, phone FROM users WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, BACKFILL_BATCH_SIZE))
+        if not rows:
+            break
+        await db.executemany(
+            'UPDATE users SET phone_key = ? WHERE id = ?',
+            [(normalize_phone(phone), user_id) for user_id, phone in rows]
+        )
+        last_id = rows[-1][0]
+
+    # Built after the backfill so the index is written once
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_users_phone_key ON users (phone_key)')
+
+async def broadcast_outbox(db: aiosqlite.Connection):
+    """Broadcast runs and their per-recipient delivery state"""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_runs (
+            id INTEGER PRIMARY KEY,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            total INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    # chat_id has no declared type so user ids stay integers and @channels stay text
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY,
+            run_id INTEGER NOT NULL REFERENCES broadcast_runs (id) ON DELETE CASCADE,
+            chat_id NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            updated_at TIMESTAMP,
+            UNIQUE (run_id, chat_id)
+        )
+    ''')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_outbox_run_status ON outbox (run_id, status)')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_runs_status ON broadcast_runs (status)')
+
+# Expressions shared by the stats triggers (row is NEW or OLD)
+_ACTIVE = "(COALESCE({row}.is_active, 0) != 0)"
+_HAS_TRACK = "(COALESCE({row}.track_code, '') != '')"
+
+async def user_stats(db: aiosqlite.Connection):
+    """Counters and a daily rollup kept current by triggers on users"""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS user_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT PRIMARY KEY,
+            registrations INTEGER NOT NULL DEFAULT 0,
+            track_codes INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+
+    # One full scan now so the triggers only ever apply deltas
+    await db.execute(f'''
+        INSERT OR REPLACE INTO user_counters (name, value)
+        SELECT 'total', COUNT(*) FROM users
+        UNION ALL SELECT 'active', COALESCE(SUM({_ACTIVE.format(row='users')}), 0) FROM users
+        UNION ALL SELECT 'with_track_code', COALESCE(SUM({_HAS_TRACK.format(row='users')}), 0) FROM users
+    ''')
+    await db.execute('''
+        INSERT OR REPLACE INTO daily_stats (day, registrations)
+        SELECT date(reg_date), COUNT(*) FROM users WHERE reg_date IS NOT NULL GROUP BY date(reg_date)
+    ''')
+
+    new_active, old_active = _ACTIVE.format(row='NEW'), _ACTIVE.format(row='OLD')
+    new_track, old_track = _HAS_TRACK.format(row='NEW'), _HAS_TRACK.format(row='OLD')
+
+    await db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS users_stats_insert AFTER INSERT ON users
+        BEGIN
+            UPDATE user_counters SET value = value + 1 WHERE name = 'total';
+            UPDATE user_counters SET value = value + {new_active} WHERE name = 'active';
+            UPDATE user_counters SET value = value + {new_track} WHERE name = 'with_track_code';
+            INSERT INTO daily_stats (day, registrations) VALUES (date(NEW.reg_date), 1)
+                ON CONFLICT (day) DO UPDATE SET registrations = registrations + 1;
+        END
+    ''')
+    await db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS users_stats_delete AFTER DELETE ON users
+        BEGIN
+            UPDATE user_counters SET value = value - 1 WHERE name = 'total';
+            UPDATE user_counters SET value = value - {old_active} WHERE name = 'active';
+            UPDATE user_counters SET value = value - {old_track} WHERE name = 'with_track_code';
+            UPDATE daily_stats SET registrations = registrations - 1 WHERE day = date(OLD.reg_date);
+        END
+    ''')
+    await db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS users_stats_update AFTER UPDATE OF is_active, track_code ON users
+        BEGIN
+            UPDATE user_counters SET value = value + {new_active} - {old_active} WHERE name = 'active';
+            UPDATE user_counters SET value = value + {new_track} - {old_track} WHERE name = 'with_track_code';
+            INSERT INTO daily_stats (day, track_codes)
+                SELECT date('now', 'localtime'), 1 WHERE {new_track} AND NOT {old_track}
+                ON CONFLICT (day) DO UPDATE SET track_codes = track_codes + 1;
+        END
+    ''')
+
+async def broadcast_prepare(db: aiosqlite.Connection):
+    """Highest users.id already enqueued, so a run prepared ahead of time can be topped up"""
+    columns = [row[1] for row in await db.execute_fetchall('PRAGMA table_info(broadcast_runs)')]
+    if 'user_watermark' not in columns:
+        await db.execute('ALTER TABLE broadcast_runs ADD COLUMN user_watermark INTEGER NOT NULL DEFAULT 0')
+
+async def _add_column(db: aiosqlite.Connection, table: str, column: str, definition: str):
+    columns = [row[1] for row in await db.execute_fetchall(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        await db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+async def delivery_times(db: aiosqlite.Connection):
+    """Per-recipient send minute and a bucket index of occupied minutes"""
+    # Minute of the day (0-1439); NULL follows the global send_time
+    await _add_column(db, 'users', 'send_minute', 'INTEGER')
+    await _add_column(db, 'channels', 'send_minute', 'INTEGER')
+    await _add_column(db, 'broadcast_runs', 'send_minute', 'INTEGER')
+    await _add_column(db, 'broadcast_runs', 'include_default', 'INTEGER NOT NULL DEFAULT 1')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_users_send_minute ON users (send_minute)')
+
+    # Recipients per custom minute, so the scheduler needs one job per occupied bucket
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS delivery_buckets (
+            minute INTEGER PRIMARY KEY,
+            recipients INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    await db.execute('''
+        INSERT OR REPLACE INTO delivery_buckets (minute, recipients)
+        SELECT send_minute, COUNT(*) FROM (
+            SELECT send_minute FROM users WHERE send_minute IS NOT NULL
+            UNION ALL SELECT send_minute FROM channels WHERE send_minute IS NOT NULL
+        ) GROUP BY send_minute
+    ''')
+
+    for table in ('users', 'channels'):
+        await db.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_bucket_insert AFTER INSERT ON {table}
+            WHEN NEW.send_minute IS NOT NULL
+            BEGIN
+                INSERT INTO delivery_buckets (minute, recipients) VALUES (NEW.send_minute, 1)
+                    ON CONFLICT (minute) DO UPDATE SET recipients = recipients + 1;
+            END
+        ''')
+        await db.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_bucket_delete AFTER DELETE ON {table}
+            WHEN OLD.send_minute IS NOT NULL
+            BEGIN
+                UPDATE delivery_buckets SET recipients = recipients - 1 WHERE minute = OLD.send_minute;
+            END
+        ''')
+        await db.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_bucket_update AFTER UPDATE OF send_minute ON {table}
+            WHEN OLD.send_minute IS NOT NEW.send_minute
+            BEGIN
+                UPDATE delivery_buckets SET recipients = recipients - 1 WHERE minute = OLD.send_minute;
+                INSERT INTO delivery_buckets (minute, recipients)
+                    SELECT NEW.send_minute, 1 WHERE NEW.send_minute IS NOT NULL
+                    ON CONFLICT (minute) DO UPDATE SET recipients = recipients + 1;
+            END
+        ''')
+
+async def subscriptions(db: aiosqlite.Connection):
+    """Per-user currency lists and per-run digest variants"""
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            user_id INTEGER NOT NULL,
+            code TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (user_id, code)
+        ) WITHOUT ROWID
+    ''')
+    # Sorted comma-joined codes of the user's subscription (NULL follows the admin's list);
+    # recipients with the same key get the same digest
+    await _add_column(db, 'users', 'subscription', 'TEXT')
+    await db.execute('CREATE INDEX IF NOT EXISTS idx_users_subscription ON users (subscription)')
+    # A re-registration replaces the row and starts from the admin's list again
+    await db.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_subscriptions_delete AFTER DELETE ON users
+        BEGIN
+            DELETE FROM subscriptions WHERE user_id = OLD.user_id;
+        END
+    ''')
+
+    await _add_column(db, 'outbox', 'variant', 'TEXT')
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_variants (
+            run_id INTEGER NOT NULL REFERENCES broadcast_runs (id) ON DELETE CASCADE,
+            variant TEXT NOT NULL,
+            text TEXT,
+            PRIMARY KEY (run_id, variant)
+        ) WITHOUT ROWID
+    ''')
+
+async def rate_positions(db: aiosqlite.Connection):
+    """Keep the CBU payload order of stored rates"""
+    # Index in the payload; rows stored before this migration stay NULL
+    await _add_column(db, 'rates', 'position', 'INTEGER')
+
+MIGRATIONS: List[Tuple[int, Migration]] = [
+    (1, base_schema),
+    (2, user_indexes),
+    (3, settings_lists),
+    (4, phone_keys),
+    (5, broadcast_outbox),
+    (6, user_stats),
+    (7, broadcast_prepare),
+    (8, delivery_times),
+    (9, subscriptions),
+    (10, rate_positions),
+]
+
+async def migrate(db: aiosqlite.Connection) -> int:
+    """Apply pending migrations in one transaction and return the schema version"""
+    async with db.execute('PRAGMA user_version') as cursor:
+        current = (await cursor.fetchone())[0]
+
+    pending = [(version, step) for version, step in MIGRATIONS if version > current]
+    if not pending:
+        return current
+
+    await db.execute('BEGIN IMMEDIATE')
+    for version, step in pending:
+        await step(db)
+        print(f"Applied migration {version}: {step.__name__}")
+    # PRAGMA does not accept bound parameters
+    await db.execute(f'PRAGMA user_version = {int(pending[-1][0])}')
+    return pending[-1][0]
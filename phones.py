@@ -0,0 +1,27 @@
+import re
+
+# Uzbekistan country code; local numbers are 9 digits (operator code + subscriber)
+COUNTRY_CODE = '998'
+LOCAL_LENGTH = 9
+
+def normalize_phone(phone: str) -> str:
+    """Canonical E.164 key (+998XXXXXXXXX) for any way a number can be typed or shared"""
+    digits = re.sub(r'\D', '', phone or '')
+    if not digits:
+        return ''
+
+    if digits.startswith('00'):
+        # International prefix: 00998...
+        digits = digits[2:]
+    elif len(digits) == LOCAL_LENGTH:
+        # 90 123 45 67
+        digits = COUNTRY_CODE + digits
+    elif len(digits) == LOCAL_LENGTH + 1 and digits.startswith('8'):
+        # Old domestic format: 8 90 123 45 67
+        digits = COUNTRY_CODE + digits[1:]
+
+    return '+' + digits
+
+def export_phone(phone: str) -> str:
+    """Phone as digits only (998XXXXXXXXX) for spreadsheets"""
+    return normalize_phone(phone).lstrip('+')
@@ -0,0 +1,91 @@
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from telegram import Message
+from telegram.ext.filters import MessageFilter
+
+Handler = Callable[..., Awaitable[Any]]
+
+class Router:
+    """Dispatch table for callback data and menu labels.
+
+    Exact keys are a dict lookup. Parameterised keys such as show_currency_USD are
+    matched by prefix: only the prefixes ending at an underscore in the key itself are
+    looked up, so the cost depends on the key length, not on how many routes exist.
+    Handlers registered on a class are plain functions called with the owner instance.
+    """
+    SEPARATOR = '_'
+
+    def __init__(self, name: str):
+        self.name = name
+        self._exact: Dict[str, Handler] = {}
+        self._prefixes: Dict[str, Handler] = {}
+
+    def exact(self, *keys: str):
+        """Decorator routing each key to the handler"""
+        def decorate(func: Handler) -> Handler:
+            for key in keys:
+                self._add(self._exact, key, func)
+            return func
+        return decorate
+
+    def prefix(self, *prefixes: str):
+        """Decorator routing keys starting with a prefix; the rest is passed as an argument"""
+        def decorate(func: Handler) -> Handler:
+            for prefix in prefixes:
+                if not prefix.endswith(self.SEPARATOR):
+                    raise ValueError(f"{self.name} prefix must end with '{self.SEPARATOR}': {prefix}")
+                self._add(self._prefixes, prefix, func)
+            return func
+        return decorate
+
+    def _add(self, table: Dict[str, Handler], key: str, func: Handler):
+        if key in table:
+            raise ValueError(f"Duplicate {self.name} route: {key}")
+        table[key] = func
+
+    def resolve(self, key: Optional[str]) -> Optional[Tuple[Handler, tuple]]:
+        """Handler and extra arguments for a key, None if nothing matches"""
+        if not key:
+            return None
+        func = self._exact.get(key)
+        if func is not None:
+            return func, ()
+        # Longest registered prefix wins (my_toggle_currency_ before a hypothetical my_)
+        end = key.rfind(self.SEPARATOR)
+        while end > 0:
+            func = self._prefixes.get(key[:end + 1])
+            if func is not None:
+                return func, (key[end + 1:],)
+            end = key.rfind(self.SEPARATOR, 0, end)
+        return None
+
+    async def dispatch(self, owner, key: Optional[str], *args) -> bool:
+        """Call the handler for key as func(owner, *args, *params); False if unrouted"""
+        route = self.resolve(key)
+        if route is None:
+            return False
+        func, params = route
+        await func(owner, *args, *params)
+        return True
+
+    def label(self, key: Optional[str]) -> str:
+        """Name of the handler a key routes to, for metrics"""
+        route = self.resolve(key)
+        return route[0].__name__ if route is not None else ''
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._exact
+
+    def filter(self) -> 'RouteFilter':
+        """PTB filter accepting messages whose text is an exact route"""
+        return RouteFilter(self)
+
+class RouteFilter(MessageFilter):
+    """Single set lookup instead of one regex handler per menu button"""
+    __slots__ = ('router',)
+
+    def __init__(self, router: Router):
+        self.router = router
+        super().__init__(name=f'RouteFilter({router.name})')
+
+    def filter(self, message: Message) -> bool:
+        return bool(message.text) and message.text in self.router
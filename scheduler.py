@@ -1,94 +1,130 @@
 import asyncio
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
+from typing import List, Optional, Sequence
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from telegram import Bot
-from telegram.constants import ParseMode
+from telegram.error import TelegramError
 
-from database import db
+from database import db, format_send_minute
 from currency_api import currency_api
-from config import BOT_TOKEN
+from messages import message_cache
+from broadcast import Broadcaster, BroadcastReport, OutboxWorker
+from config import BOT_TOKEN, ADMIN_IDS, BROADCAST_WARMUP_MINUTES
 
 class CurrencyScheduler:
     def __init__(self):
         self.scheduler = AsyncIOScheduler()
         self.bot = Bot(token=BOT_TOKEN)
+        self.broadcaster = Broadcaster(self.bot)
+        self.outbox = OutboxWorker(self.broadcaster, render=self.render_digest)
+        # Run enqueued by the warm-up job, released at send time
+        self._prepared_run: Optional[int] = None
 
-    async def send_currency_update(self):
-        """Send daily currency update to all users and configured channels"""
+    async def render_digest(self, codes: Sequence[str]) -> Optional[str]:
+        """Broadcast digest for one subscribed currency list, shared through the message cache"""
+        return await message_cache.digest(list(codes), kind='broadcast', wait=True)
+
+    async def alert_admins(self, text: str):
+        """Notify every admin, ignoring delivery errors"""
+        for admin_id in ADMIN_IDS:
+            try:
+                await self.bot.send_message(chat_id=admin_id, text=text)
+            except TelegramError as e:
+                print(f"Failed to alert admin {admin_id}: {e}")
+
+    async def warm_up(self) -> Optional[int]:
+        """Fetch and check today's rates, render the digest and enqueue recipients before send time"""
         try:
+            if self._prepared_run is not None:
+                # A newer warm-up replaces the previous one
+                await db.finish_broadcast_run(self._prepared_run, status='expired')
+                self._prepared_run = None
+
             settings = await db.get_settings()
-            selected_currencies = settings.get('selected_currencies', 'USD').split(',')
-            selected_currencies = [curr.strip() for curr in selected_currencies if curr.strip()]
-            channels = settings.get('channels', '').split(',')
+            selected_currencies = settings.selected_currencies
+            if not selected_currencies:
+                await self.alert_admins("⚠️ Kunlik yuborish: hech qanday valyuta tanlanmagan.")
+                return None
+
+            today = datetime.now().strftime('%Y-%m-%d')
+            snapshot = await currency_api.get_snapshot(today, wait=True)
+            problems: List[str] = []
+            if snapshot is None:
+                problems.append("CBU dan kurslar olinmadi")
+            else:
+                if snapshot.is_stale_for(today):
+                    problems.append(f"bugungi kurslar yo'q, {snapshot.date} holatidagi kurslar yuboriladi")
+                missing = [code for code in selected_currencies if code not in snapshot.by_code]
+                if missing:
+                    problems.append(f"kurslari topilmagan valyutalar: {', '.join(missing)}")
+
+            # Rendered into the shared cache, so send time only looks it up
+            message = await message_cache.digest(selected_currencies, kind='broadcast', date=today, wait=True)
+            if message:
+                # Only the global time's recipients; custom buckets enqueue at their own minute
+                self._prepared_run = await self.outbox.prepare(message, minute=settings.send_minute)
+
+            if problems:
+                await self.alert_admins(
+                    f"⚠️ Kunlik yuborish ({settings.send_time}) tayyorgarligi: " + "; ".join(problems) + "."
+                )
+            return self._prepared_run
+
+        except Exception as e:
+            print(f"Error in warm_up: {e}")
+
+    async def send_scheduled_update(self) -> Optional[BroadcastReport]:
+        """Cron entry point for the global send time: release the prepared run if the warm-up made one"""
+        run_id, self._prepared_run = self._prepared_run, None
+        settings = await db.get_settings()
+        return await self.send_currency_update(run_id, minute=settings.send_minute)
+
+    async def send_bucket(self, minute: int) -> Optional[BroadcastReport]:
+        """Cron entry point for recipients who picked their own delivery time"""
+        return await self.send_currency_update(minute=minute, include_default=False)
+
+    async def send_currency_update(self, run_id: Optional[int] = None, minute: Optional[int] = None,
+                                   include_default: bool = True) -> Optional[BroadcastReport]:
+        """Send daily currency update to users and configured channels.
+
+        run_id is a run prepared by warm_up; without it recipients are enqueued now.
+        minute limits the send to one delivery bucket, None sends to everyone.
+        """
+        try:
+            settings = await db.get_settings()
+            selected_currencies = settings.selected_currencies
             
             if not selected_currencies:
                 print("No currencies selected for update")
                 return
             
-            # Get all users
-            users = await db.get_all_users()
-            
-            # Collect all currency data
-            currency_messages = []
-            for currency_code in selected_currencies:
-                currency_data = await currency_api.get_currency_by_code(currency_code)
-                
-                if not currency_data:
-                    print(f"Failed to fetch currency data for {currency_code}")
-                    continue
-                
-                # Format individual currency info with flag
-                from handlers import format_currency_with_flag
-                currency_info = format_currency_with_flag(currency_data)
-                
-                currency_messages.append(currency_info)
+            # Rendered once per rate snapshot and shared with the handlers; the daily post
+            # waits for today's rates and only falls back to older ones if CBU is down
+            message = await message_cache.digest(selected_currencies, kind='broadcast', wait=True)
             
-            if not currency_messages:
+            if not message:
                 print("No currency data available to send")
                 return
             
-            # Combine all currencies into one message
-            message = f"""📊 **Valyuta kurslari yangilanishi**
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-{''.join(currency_messages)}
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-📅 **Sana:** {datetime.now().strftime('%d.%m.%Y')}
-📊 **O'zbekiston Respublikasi Markaziy Banki**"""
-            
-            # Send to all users
-            for user in users:
-                try:
-                    await self.bot.send_message(
-                        chat_id=user['user_id'],
-                        text=message,
-                        parse_mode=ParseMode.MARKDOWN
-                    )
-                    print(f"Currency update sent to user {user['user_id']}")
-                except Exception as e:
-                    print(f"Failed to send to user {user['user_id']}: {e}")
-            
-            # Send to all configured channels
-            for channel in channels:
-                channel = channel.strip()
-                if channel:
-                    try:
-                        await self.bot.send_message(
-                            chat_id=channel,
-                            text=message,
-                            parse_mode=ParseMode.MARKDOWN
-                        )
-                        print(f"Currency update sent to channel {channel}")
-                    except Exception as e:
-                        print(f"Failed to send to channel {channel}: {e}")
-                        
+            # Users and configured channels go through the outbox so a restart can resume
+            if run_id is not None:
+                report = await self.outbox.release(run_id, message)
+                if report is not None:
+                    return report
+            return await self.outbox.send(message, minute, include_default)
+
         except Exception as e:
             print(f"Error in send_currency_update: {e}")
 
     async def update_schedule(self):
         """Update the scheduled job based on current settings"""
         try:
+            if self._prepared_run is not None:
+                # Prepared for the old send time; the next warm-up prepares the new one
+                await db.finish_broadcast_run(self._prepared_run, status='expired')
+                self._prepared_run = None
+
             # Remove existing job
             if self.scheduler.get_job('currency_update'):
                 self.scheduler.remove_job('currency_update')
@@ -96,7 +132,7 @@ class CurrencyScheduler:
             
             # Get current settings
             settings = await db.get_settings()
-            send_time = settings.get('send_time', '09:00')
+            send_time = settings.send_time
             print(f"Setting up schedule for time: {send_time}")
             
             # Parse time
@@ -105,14 +141,29 @@ class CurrencyScheduler:
             
             # Add new job
             self.scheduler.add_job(
-                self.send_currency_update,
+                self.send_scheduled_update,
                 CronTrigger(hour=hour, minute=minute),
                 id='currency_update',
                 replace_existing=True
             )
             
             print(f"Currency update scheduled for {send_time} daily")
+
+            # Warm-up runs BROADCAST_WARMUP_MINUTES earlier (wrapping past midnight)
+            if self.scheduler.get_job('currency_warmup'):
+                self.scheduler.remove_job('currency_warmup')
+            if BROADCAST_WARMUP_MINUTES > 0:
+                warmup = datetime.combine(datetime.now().date(), time(hour, minute)) - timedelta(minutes=BROADCAST_WARMUP_MINUTES)
+                self.scheduler.add_job(
+                    self.warm_up,
+                    CronTrigger(hour=warmup.hour, minute=warmup.minute),
+                    id='currency_warmup',
+                    replace_existing=True
+                )
+                print(f"Currency warm-up scheduled for {warmup.strftime('%H:%M')} daily")
             
+            await self.sync_buckets(settings.send_minute)
+
             # List all jobs to verify
             jobs = self.scheduler.get_jobs()
             print(f"Current jobs: {[job.id for job in jobs]}")
@@ -120,6 +171,46 @@ class CurrencyScheduler:
         except Exception as e:
             print(f"Error updating schedule: {e}")
 
+    async def sync_buckets(self, default_minute: Optional[int] = None):
+        """One cron job per delivery minute picked by users or channels.
+
+        Recipients at the global send time are covered by the currency_update job,
+        so only the other occupied minutes get a delivery_HHMM job.
+        """
+        try:
+            if default_minute is None:
+                default_minute = (await db.get_settings()).send_minute
+            buckets = await db.get_delivery_buckets()
+            wanted = {
+                f'delivery_{minute:04d}': minute for minute in buckets if minute != default_minute
+            }
+
+            for job in self.scheduler.get_jobs():
+                if job.id.startswith('delivery_') and job.id not in wanted:
+                    self.scheduler.remove_job(job.id)
+
+            for job_id, minute in wanted.items():
+                if self.scheduler.get_job(job_id):
+                    continue
+                self.scheduler.add_job(
+                    self.send_bucket,
+                    CronTrigger(hour=minute // 60, minute=minute % 60),
+                    args=[minute],
+                    id=job_id,
+                    replace_existing=True
+                )
+                print(f"Delivery bucket scheduled for {format_send_minute(minute)} ({buckets[minute]} recipients)")
+
+        except Exception as e:
+            print(f"Error syncing delivery buckets: {e}")
+
+    async def resume_broadcasts(self):
+        """Resume broadcast runs left unfinished by a restart"""
+        try:
+            await self.outbox.resume()
+        except Exception as e:
+            print(f"Error resuming broadcasts: {e}")
+
     def start(self):
         """Start the scheduler"""
         self.scheduler.start()
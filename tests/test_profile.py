@@ -0,0 +1,42 @@
+import asyncio
+import os
+import tempfile
+from types import SimpleNamespace
+
+# Must be set before the bot modules read config
+os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='test_'), 'test.db')
+
+from database import db
+from handlers import handlers
+
+class FakeMessage:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+async def show_profile(user_id):
+    message = FakeMessage()
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=user_id), message=message)
+    await handlers.my_profile(update, SimpleNamespace(user_data={}))
+    return message.replies
+
+async def profiles():
+    await db.init_db()
+    try:
+        await db.add_user(1, 'Default User', '+998901111111')
+        await db.add_user(2, 'Personal User', '+998902222222')
+        await db.set_user_send_minute(2, 8 * 60 + 30)
+        settings = await db.get_settings()
+        return await show_profile(1), await show_profile(2), settings.send_time
+    finally:
+        await db.close()
+
+def test_my_profile_shows_default_and_personal_send_time():
+    default_replies, personal_replies, send_time = asyncio.run(profiles())
+
+    assert len(default_replies) == 1
+    assert f"⏰ Yuborish vaqti: {send_time} (standart)" in default_replies[0]
+    assert len(personal_replies) == 1
+    assert "⏰ Yuborish vaqti: 08:30" in personal_replies[0]
@@ -0,0 +1,143 @@
+import csv
+import io
+from dataclasses import dataclass, field
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from phones import normalize_phone, export_phone
+
+# Header words recognised in the first row (export files use "Telefon" / "Trek kod")
+PHONE_HEADERS = ('telefon', 'phone', 'телефон', 'raqam')
+TRACK_HEADERS = ('trek', 'track', 'трек')
+
+# Summary statuses
+STATUS_UPDATED = 'yangilandi'
+STATUS_UNMATCHED = 'topilmadi'
+STATUS_DUPLICATE = 'takroriy'
+STATUS_INVALID = "noto'g'ri"
+
+# (row number, phone as written, track code)
+ImportRow = Tuple[int, str, str]
+
+def _cell_text(value) -> str:
+    """Spreadsheet cell as text; phone numbers often arrive as floats"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+def _find_columns(cells: Sequence[str]) -> Optional[Tuple[int, int]]:
+    """Phone and track column indexes if the row is a header"""
+    phone_col = track_col = None
+    for index, cell in enumerate(cells):
+        text = cell.lower()
+        if phone_col is None and any(word in text for word in PHONE_HEADERS):
+            phone_col = index
+        elif track_col is None and any(word in text for word in TRACK_HEADERS):
+            track_col = index
+    if phone_col is None or track_col is None:
+        return None
+    return phone_col, track_col
+
+def read_csv(file: BinaryIO) -> Iterator[Sequence]:
+    """Rows of a CSV upload; the delimiter is sniffed because Excel often writes ';'"""
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    sample = text.read(4096)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    try:
+        yield from csv.reader(text, dialect)
+    finally:
+        text.detach()
+
+def read_xlsx(file: BinaryIO) -> Iterator[Sequence]:
+    """Rows of the first sheet, streamed in read-only mode"""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        yield from wb.active.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+def read_rows(file: BinaryIO, extension: str) -> Iterator[Sequence]:
+    if extension == 'xlsx':
+        return read_xlsx(file)
+    return read_csv(file)
+
+def iter_track_rows(rows: Iterable[Sequence]) -> Iterator[ImportRow]:
+    """(row number, phone, track code) pairs.
+
+    Columns are taken from a header row when there is one (so an export file can be
+    filled in and sent back), otherwise the first two columns are phone and track code.
+    """
+    columns = None
+    for number, row in enumerate(rows, 1):
+        cells = [_cell_text(value) for value in row or ()]
+        if not any(cells):
+            continue
+        if columns is None:
+            columns = _find_columns(cells)
+            if columns is not None:
+                continue
+            columns = (0, 1)
+        phone_col, track_col = columns
+        phone = cells[phone_col] if phone_col < len(cells) else ''
+        track_code = cells[track_col] if track_col < len(cells) else ''
+        yield number, phone, track_code
+
+@dataclass
+class ImportPlan:
+    """Parsed upload: the last row per phone wins, earlier ones are duplicates"""
+    updates: Dict[str, ImportRow] = field(default_factory=dict)
+    duplicates: List[ImportRow] = field(default_factory=list)
+    invalid: List[ImportRow] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return len(self.updates) + len(self.duplicates) + len(self.invalid)
+
+def plan_import(rows: Iterable[Sequence]) -> ImportPlan:
+    """Group rows by canonical phone key"""
+    plan = ImportPlan()
+    for row in iter_track_rows(rows):
+        _, phone, track_code = row
+        phone_key = normalize_phone(phone)
+        if not phone_key or not track_code:
+            plan.invalid.append(row)
+            continue
+        previous = plan.updates.get(phone_key)
+        if previous is not None:
+            plan.duplicates.append(previous)
+        plan.updates[phone_key] = row
+    return plan
+
+def write_summary(plan: ImportPlan, matched: Set[str], file: BinaryIO) -> Dict[str, int]:
+    """Write one CSV line per input row with its outcome and return the counts"""
+    outcomes = [
+        (row, STATUS_UPDATED if phone_key in matched else STATUS_UNMATCHED, phone_key)
+        for phone_key, row in plan.updates.items()
+    ]
+    outcomes.extend((row, STATUS_DUPLICATE, normalize_phone(row[1])) for row in plan.duplicates)
+    outcomes.extend((row, STATUS_INVALID, '') for row in plan.invalid)
+    outcomes.sort(key=lambda item: item[0][0])
+
+    output = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    writer = csv.writer(output)
+    writer.writerow(['Qator', 'Telefon', 'Trek kod', 'Holat'])
+    for (number, phone, track_code), status, phone_key in outcomes:
+        writer.writerow([number, export_phone(phone_key) if phone_key else phone, track_code, status])
+    output.flush()
+    output.detach()
+
+    updated = sum(1 for phone_key in plan.updates if phone_key in matched)
+    return {
+        'total': plan.total,
+        'updated': updated,
+        'unmatched': len(plan.updates) - updated,
+        'duplicates': len(plan.duplicates),
+        'invalid': len(plan.invalid),
+    }
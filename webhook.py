@@ -0,0 +1,137 @@
+import asyncio
+import hmac
+import json
+import re
+import signal
+from typing import Optional
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from config import (
+    ALLOWED_UPDATES, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS
+)
+
+# Characters and length Telegram accepts for secret_token
+SECRET_TOKEN_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,256}$')
+
+class WebhookServer:
+    """Embedded aiohttp server that feeds Telegram updates into the application queue"""
+
+    def __init__(self, application: Application,
+                 listen: str = WEBHOOK_LISTEN,
+                 port: int = WEBHOOK_PORT,
+                 path: str = WEBHOOK_PATH,
+                 secret_token: Optional[str] = WEBHOOK_SECRET):
+        # Without a secret anyone who finds the endpoint can post updates as any user
+        if not secret_token or not SECRET_TOKEN_PATTERN.match(secret_token):
+            raise ValueError("WEBHOOK_SECRET must be set to 1-256 characters A-Z, a-z, 0-9, _ or - in webhook mode")
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = '/' + path.strip('/')
+        self.secret_token = secret_token
+        self._runner: Optional[web.AppRunner] = None
+
+    def build_app(self) -> web.Application:
+        """aiohttp app with the webhook and health routes"""
+        app = web.Application(client_max_size=1024 ** 2)
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get('/health', self.handle_health)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        """Verify the secret token and enqueue one update"""
+        token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            return web.Response(status=403, text='Forbidden')
+
+        try:
+            data = await request.json()
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            return web.Response(status=400, text='Invalid JSON')
+
+        try:
+            update = Update.de_json(data, self.application.bot) if isinstance(data, dict) else None
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Rejected malformed update: {e}")
+            update = None
+        if update is None:
+            return web.Response(status=400, text='Invalid update')
+
+        try:
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # Telegram retries non-2xx responses, so this is our backpressure
+            print(f"Update queue full, rejecting update {update.update_id}")
+            return web.Response(status=503, text='Busy')
+
+        return web.Response(text='OK')
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        """Liveness and queue depth"""
+        queue = self.application.update_queue
+        return web.json_response({
+            'status': 'ok' if self.application.running else 'starting',
+            'queue_size': queue.qsize(),
+            'queue_max': queue.maxsize,
+        })
+
+    async def start(self):
+        """Start listening for updates"""
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        print(f"Webhook server listening on {self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        """Stop the server"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+async def serve(application: Application):
+    """Run the application in webhook mode until SIGINT/SIGTERM"""
+    server = WebhookServer(application)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + server.path,
+                secret_token=server.secret_token,
+                allowed_updates=ALLOWED_UPDATES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+        else:
+            # Local testing: POST recorded updates straight to the endpoint
+            print("WEBHOOK_URL is not set, Telegram webhook was not registered")
+
+        await application.start()
+        await server.start()
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+def run_webhook(application: Application):
+    """Blocking entry point, the webhook counterpart of run_polling"""
+    asyncio.run(serve(application))